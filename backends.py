@@ -0,0 +1,182 @@
+"""
+NER backends, i.e. models that find names in many texts at once, and are
+loaded, warmed up and closed, as opposed to strategies that are plain
+functions of one text.
+
+as_extractor turns a backend into a strategy that fits in a stage of Stages
+and caches what it finds for each text, and extract_many sends every text of
+a chunk that isn't cached yet to the backend in one batch. SpacyBackend runs a
+spaCy pipeline locally, and local_ner_stages uses it instead of Google, e.g.
+for offline runs. spaCy and its models are only needed if it's used:
+
+    pipenv install --categories spacy
+    pipenv run python -m spacy download xx_ent_wiki_sm
+"""
+import contextlib
+from typing import Any, Callable, Iterator, List, Optional, Sequence
+from cache import cache, function_version, hash_key, VERSION_LENGTH
+from strategies import Cost, Names, Stages, remove_contained_names
+
+try:
+    from typing import Protocol
+except ImportError:  # before 3.8
+    from typing_extensions import Protocol  # type: ignore
+
+
+class Backend(Protocol):
+    # what its results are cached as, and the strategy is called
+    name: str
+    cost: Cost
+
+    @property
+    def version(self) -> str:
+        "Changes whenever its results would, so that old ones aren't used."
+
+    def load(self) -> None:
+        "Load the model, if it isn't yet. extract_many loads it when needed."
+
+    def warm_up(self) -> None:
+        "Load the model and run it once, so the first record isn't slow."
+
+    def extract_many(self, texts: Sequence[str]) -> List[Names]: ...
+
+    def close(self) -> None:
+        "Free the model. It's loaded again if it's used again."
+
+
+def as_extractor(backend: Backend) -> Callable[[str], Names]:
+    "A strategy for one text, cached under backend.name, with the backend attached."
+
+    def extract(text: str) -> Names:
+        return backend.extract_many([text])[0]
+
+    extract.__name__ = extract.__qualname__ = backend.name
+    extractor = cache.with_cache(extract, version=backend.version)
+    extractor.backend = backend  # type: ignore
+    return extractor
+
+
+def extract_many(
+    extractor: Callable[[str], Names], texts: Sequence[str]
+) -> List[Names]:
+    """
+    extractor for each text, but if it's a backend's, sending every text that
+    isn't cached yet to the backend at once, and caching each result.
+    """
+    backend: Optional[Backend] = getattr(extractor, "backend", None)
+    if backend is None:
+        return [extractor(text) for text in texts]
+    func_name = extractor.__name__
+    uncached_texts = list(
+        dict.fromkeys(text for text in texts if not cache.contains(text, func_name))
+    )
+    if uncached_texts:
+        for text, names in zip(uncached_texts, backend.extract_many(uncached_texts)):
+            cache.put(text, func_name, names)
+    return [cache.get(text, func_name) for text in texts]
+
+
+def backend_extractors(stages: Stages) -> List[Callable[[str], Names]]:
+    return [
+        extractor
+        for extractors in stages[:2]
+        for extractor in extractors
+        if hasattr(extractor, "backend")
+    ]
+
+
+def backends(stages: Stages) -> List[Backend]:
+    "Every backend used in stages, once each."
+    unique = {}
+    for extractor in backend_extractors(stages):
+        backend = extractor.backend  # type: ignore # it has one
+        unique[id(backend)] = backend
+    return list(unique.values())
+
+
+def warm_up(stages: Stages) -> None:
+    for backend in backends(stages):
+        backend.warm_up()
+
+
+@contextlib.contextmanager
+def closing(stages: Stages) -> Iterator[None]:
+    "Close the backends in stages afterwards, whether or not they were loaded."
+    try:
+        yield
+    finally:
+        for backend in backends(stages):
+            backend.close()
+
+
+def local_ner_stages(stages: Stages, backend: Backend) -> Stages:
+    "stages with backend finding names instead of Google."
+    _, crude_extractors, refiners = stages
+    return ([as_extractor(backend)], crude_extractors, refiners)
+
+
+def package_version(package: str) -> str:
+    "The installed version of package, or nothing if that can't be found out."
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:  # before 3.8
+        return ""
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return ""
+
+
+class SpacyBackend:
+    """
+    People spaCy's named entity recognizer finds, which runs locally, so it
+    doesn't need the network and isn't paid for per call, and is much faster
+    than NLTK's chunker on batches. xx_ent_wiki_sm is multilingual, and labels
+    people PER, while the English models label them PERSON.
+    """
+
+    cost = Cost.local_model
+    PERSON_LABELS = frozenset(["PERSON", "PER"])
+    # what the recognizer may depend on, everything else is skipped
+    NER_PIPES = ("tok2vec", "transformer", "ner")
+
+    def __init__(self, model: str = "xx_ent_wiki_sm", batch_size: int = 256):
+        self.model = model
+        self.batch_size = batch_size
+        self.name = "spacy_extract_names_" + model
+        self.nlp: Any = None
+
+    @property
+    def version(self) -> str:
+        "Changes with the model's version, and with how names are picked out."
+        versions = [
+            function_version(SpacyBackend.extract_many),
+            self.model,
+            package_version(self.model),
+        ]
+        return hash_key(" ".join(versions))[:VERSION_LENGTH]
+
+    def load(self) -> None:
+        if self.nlp is not None:
+            return
+        import spacy
+
+        nlp = spacy.load(self.model)
+        nlp.select_pipes(enable=[p for p in nlp.pipe_names if p in self.NER_PIPES])
+        self.nlp = nlp
+
+    def warm_up(self) -> None:
+        self.extract_many(["Warm up with John Smith."])
+
+    def extract_many(self, texts: Sequence[str]) -> List[Names]:
+        self.load()
+        labels = self.PERSON_LABELS
+        return [
+            remove_contained_names(
+                [entity.text for entity in doc.ents if entity.label_ in labels]
+            )
+            for doc in self.nlp.pipe(texts, batch_size=self.batch_size)
+        ]
+
+    def close(self) -> None:
+        self.nlp = None
@@ -0,0 +1,61 @@
+"""
+Compare extract_contacts with running PhoneNumberMatcher and EMAIL_RE on
+every line, as it used to, over multilingual records.
+
+    python -m benchmarks.bench_contacts [--records N] [--repeat N]
+"""
+import argparse
+import time
+from typing import Callable, List, Tuple
+from phonenumbers import PhoneNumberMatcher, format_number, PhoneNumberFormat
+from benchmarks.corpus import multilingual_records
+from extract_info import extract_contacts, could_have_phones, EMAIL_RE, _format_phone
+
+
+def unfiltered_extract_contacts(line: str) -> Tuple[List[str], List[str]]:
+    "extract_contacts before lines were filtered and formatting was cached."
+    emails = EMAIL_RE.findall(line)
+    phones = [
+        format_number(match.number, PhoneNumberFormat.INTERNATIONAL)
+        for match in PhoneNumberMatcher(line, "US")
+    ]
+    return emails, phones
+
+
+def lines_per_second(
+    function: Callable[[str], Tuple[List[str], List[str]]],
+    lines: List[str],
+    repeat: int,
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        _format_phone.cache_clear()
+        start = time.perf_counter()
+        for line in lines:
+            function(line)
+        timings.append(time.perf_counter() - start)
+    return len(lines) / min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    lines = multilingual_records(args.records)
+    assert list(map(extract_contacts, lines)) == list(
+        map(unfiltered_extract_contacts, lines)
+    )
+    before = lines_per_second(unfiltered_extract_contacts, lines, args.repeat)
+    after = lines_per_second(extract_contacts, lines, args.repeat)
+    skipped = sum(not could_have_phones(line) for line in lines) / len(lines)
+    print(
+        "{} records, {:.0%} without a possible phone: before {:.0f} lines/s, "
+        "after {:.0f} lines/s ({:.2f}x)".format(
+            len(lines), skipped, before, after, after / before
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
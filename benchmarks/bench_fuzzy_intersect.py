@@ -0,0 +1,83 @@
+"""
+Compare fuzzy_intersect with the original recursive version on records with
+many names.
+
+    python -m benchmarks.bench_fuzzy_intersect [--names N] [--repeat N]
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from typing import List
+from benchmarks.corpus import FIRST_NAMES, LAST_NAMES
+from extract_info import fuzzy_intersect
+
+
+def recursive_fuzzy_intersect(
+    left: List[str], right: List[str], recursive: bool = False
+) -> List[str]:
+    "fuzzy_intersect before it was made iterative."
+    if recursive:
+        if not left:
+            return []
+    else:
+        if not (left and right):
+            return left or right
+    first_left, *remaining_left = left
+    similar_right = set(
+        right_name
+        for right_name in right
+        if right_name in first_left or first_left in right_name
+    )
+    if similar_right:
+        also_similar_left = set(
+            left_name
+            for left_name in remaining_left
+            if left_name in first_left or first_left in left_name
+        )
+        intersection = max(first_left, *similar_right, *also_similar_left, key=len)
+        dissimilar_right = list(set(right) - similar_right)
+        dissimilar_left = list(set(remaining_left) - also_similar_left)
+        return [intersection] + recursive_fuzzy_intersect(
+            dissimilar_left, dissimilar_right, True
+        )
+    return recursive_fuzzy_intersect(remaining_left, right, recursive=True)
+
+
+def names(rng: random.Random, count: int) -> List[str]:
+    return [
+        "{} {}{}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), index)
+        for index in range(count)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--names", type=int, nargs="*", default=[5, 20, 100, 500])
+    args = parser.parse_args()
+    sys.setrecursionlimit(10000)
+    rng = random.Random(0)
+    for count in args.names:
+        left = names(rng, count)
+        # half of them match a name on the left, some by containing it
+        right = [name.split()[0] for name in left[::4]] + left[1::4] + names(rng, count)
+        rng.shuffle(right)
+        timings = [
+            min(
+                timeit.repeat(
+                    lambda: function(left, right), number=1, repeat=args.repeat
+                )
+            )
+            for function in (recursive_fuzzy_intersect, fuzzy_intersect)
+        ]
+        print(
+            "{:>5} names: recursive {:.3f} ms, iterative {:.3f} ms".format(
+                count, *(timing * 1000 for timing in timings)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare analyze_metrics with classifying entries one at a time into lists, as
+it used to, on random entries.
+
+    python -m benchmarks.bench_metrics [--records N] [--repeat N]
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+from typing import Any, Callable, List, Mapping
+from extract_info import Entry, EntryType, analyze_metrics, decide_entry_type
+
+
+def listed_analyze_metrics(entries: List[Entry]) -> Mapping[EntryType, List[Entry]]:
+    "analyze_metrics' entries by type before it was columnar."
+    typed_entries = [(decide_entry_type(entry), entry) for entry in entries]
+    return {
+        entry_type: [entry for types, entry in typed_entries if entry_type in types]
+        for entry_type in EntryType
+    }
+
+
+def random_entries(count: int, seed: int = 0) -> List[Entry]:
+    rng = random.Random(seed)
+    return [
+        Entry(
+            ["record {}".format(index)],
+            ["a@b.c"] * rng.randint(0, 2),
+            ["+1 617-555-0100"] * rng.randint(0, 3),
+            ["Name"] * rng.randint(0, 3),
+        )
+        for index in range(count)
+    ]
+
+
+def seconds(
+    function: Callable[[List[Entry]], Any], entries: List[Entry], repeat: int
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(entries)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    entries = random_entries(args.records)
+    listed = listed_analyze_metrics(entries)
+    with contextlib.redirect_stdout(io.StringIO()):
+        indices_by_type, _ = analyze_metrics(entries)
+    for entry_type, indices in indices_by_type.items():
+        assert [entries[index] for index in indices] == listed[entry_type]
+    before = seconds(listed_analyze_metrics, entries, args.repeat)
+    after = seconds(analyze_metrics, entries, args.repeat)
+    print(
+        "{} records: before {:.3f}s, after {:.3f}s ({:.1f}x)".format(
+            len(entries), before, after, before / after
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
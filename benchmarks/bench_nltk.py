@@ -0,0 +1,38 @@
+"""
+Compare nltk_extract_names one record at a time with nltk_extract_names_many.
+
+    python -m benchmarks.bench_nltk [--records N]
+
+Both start from an empty in-memory cache, so every record is extracted.
+"""
+import argparse
+import time
+from typing import Callable
+import nltk_models
+from benchmarks.corpus import records
+from cache import cache
+from strategies import nltk_extract_names, nltk_extract_names_many
+
+
+def throughput(extract: Callable[[], object], count: int) -> float:
+    cache.clear_cache("nltk_extract_names")
+    start = time.perf_counter()
+    extract()
+    return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=500)
+    args = parser.parse_args()
+    # distinct texts, so that neither one can get cache hits
+    texts = ["{} #{}".format(text, i) for i, text in enumerate(records(args.records))]
+    nltk_models.preload()
+    per_record = throughput(lambda: list(map(nltk_extract_names, texts)), len(texts))
+    batched = throughput(lambda: nltk_extract_names_many(texts), len(texts))
+    print("per record: {:.1f} records/s".format(per_record))
+    print("batched:    {:.1f} records/s".format(batched))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Time starting python and importing extract_info, which is most of what a run
+that's served from the cache does, and list what the import spends its time on
+according to python -X importtime.
+
+    python -m benchmarks.bench_startup [--repeat N] [--budget SECONDS]
+
+Exits with an error if startup takes longer than the budget.
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+# e.g. "import time:       453 |      25720 |   strategies"
+IMPORT_TIME_RE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)$", re.MULTILINE)
+BUDGET = 0.2
+
+
+def import_times(module: str) -> Tuple[float, List[Tuple[int, str, float]]]:
+    """
+    Seconds it took to start python and import module, and (nesting level,
+    name, cumulative seconds) for each module imported, in the order they
+    finished importing.
+    """
+    start = time.perf_counter()
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stderr
+    seconds = time.perf_counter() - start
+    return seconds, [
+        (len(indent) // 2, name, int(microseconds) / 1e6)
+        for microseconds, indent, name in IMPORT_TIME_RE.findall(stderr)
+    ]
+
+
+def direct_imports(
+    imports: List[Tuple[int, str, float]], module: str
+) -> Dict[str, float]:
+    "Cumulative seconds of each module that module imported itself."
+    position = next(
+        position
+        for position, (level, name, _) in enumerate(imports)
+        if level == 0 and name == module
+    )
+    children = {}
+    # imports finish before what imported them, so they're listed before it
+    for level, name, seconds in reversed(imports[:position]):
+        if level == 0:
+            break
+        if level == 1:
+            children[name] = seconds
+    return dict(sorted(children.items(), key=lambda child: -child[1]))
+
+
+def startup(module: str = "extract_info", repeat: int = 5) -> Dict[str, Any]:
+    "The fastest of repeat startups, since the slower ones are mostly noise."
+    seconds, imports = min(
+        (import_times(module) for _ in range(repeat)), key=lambda run: run[0]
+    )
+    return {
+        "seconds": seconds,
+        "import_seconds": next(s for _, name, s in imports if name == module),
+        "imports": direct_imports(imports, module),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="extract_info")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=BUDGET,
+        metavar="SECONDS",
+        help="longest startup that's acceptable (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    results = startup(args.module, args.repeat)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if results["seconds"] > args.budget:
+        sys.exit(
+            "startup took {:.3f}s, over the budget of {}s".format(
+                results["seconds"], args.budget
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Synthetic Trello-like records, so that benchmarks don't need the real export."""
+import random
+from typing import Any, List
+
+FIRST_NAMES = ["Lisa", "Bob", "Ariel", "Pierre", "Stephanie", "David", "Marion"]
+LAST_NAMES = ["Miller", "Kochi", "McCall", "Smith", "Nguyen", "Garcia"]
+NOISE = ["paid", "cr card", "balloon drop", "check deposited", "-- off", "X 119"]
+MULTILINGUAL_NAMES = [
+    "Lisa Miller",
+    "Pierre Lefèvre",
+    "Мария Иванова",
+    "Дмитрий Соколов",
+    "王芳",
+    "Zoë Müller",
+    "José Álvarez",
+    "Αλέξανδρος Παπαδόπουλος",
+]
+MULTILINGUAL_NOISE = NOISE + [
+    "оплачено",
+    "доставка 12/3",
+    "已付款",
+    "payé en espèces",
+    "$200 deposit",
+    "order #4471",
+    "room 12",
+]
+PHONE_FORMATS = [
+    "617.555.{:04}",
+    "(617) 555-{:04}",
+    "+7 495 123-{:04}",
+    "+44 20 7946 {:04}",
+    "+33 1 42 68 {:04}",
+    "+86 10 6552 {:04}",
+]
+
+
+def record(rng: random.Random) -> str:
+    name = "{} {}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+    phone = "617.555.{:04}".format(rng.randrange(10000))
+    return "{}/{} -- {} {} {}".format(
+        rng.randint(1, 12), rng.randint(1, 28), name, rng.choice(NOISE), phone
+    )
+
+
+def records(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [record(rng) for _ in range(count)]
+
+
+def multilingual_record(
+    rng: random.Random,
+    max_phones: int = 2,
+    email_rate: float = 0.3,
+    max_noise: int = 2,
+) -> str:
+    """
+    A record in one of several scripts, with up to max_phones phones, an email
+    email_rate of the time, and often numbers that aren't phones.
+    """
+    parts = ["{}/{}".format(rng.randint(1, 12), rng.randint(1, 28)), "--"]
+    parts.append(rng.choice(MULTILINGUAL_NAMES))
+    parts.extend(rng.sample(MULTILINGUAL_NOISE, rng.randint(0, max_noise)))
+    for _ in range(rng.randint(0, max_phones)):
+        parts.append(rng.choice(PHONE_FORMATS).format(rng.randrange(10000)))
+    if rng.random() < email_rate:
+        parts.append("contact{}@example.com".format(rng.randrange(100)))
+    return " ".join(parts)
+
+
+def multilingual_records(count: int, seed: int = 0, **options: Any) -> List[str]:
+    "multilingual_record options apply to every record."
+    rng = random.Random(seed)
+    return [multilingual_record(rng, **options) for _ in range(count)]
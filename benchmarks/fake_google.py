@@ -0,0 +1,35 @@
+"""
+A deterministic stand-in for google_extract_names, so that benchmarks don't
+need the network or credentials.
+"""
+import re
+import time
+from typing import List
+from strategies import Extractors, GOOGLE_PREPROCESSES, compose
+from benchmarks.corpus import FIRST_NAMES, LAST_NAMES, MULTILINGUAL_NAMES
+
+NAME_RE = re.compile(
+    "|".join(
+        ["(?:{}) (?:{})".format("|".join(FIRST_NAMES), "|".join(LAST_NAMES))]
+        + list(map(re.escape, MULTILINGUAL_NAMES))
+    )
+)
+
+
+def corpus_names(raw_text: str, latency: float = 0.0) -> List[str]:
+    "The corpus' full names in raw_text, as if Google never made mistakes."
+    if latency:
+        time.sleep(latency)
+    return NAME_RE.findall(raw_text)
+
+
+def fake_google_extractors(latency: float = 0.0) -> Extractors:
+    "GOOGLE_EXTRACTORS, but with fake_google_extract_names taking latency seconds."
+
+    def fake_google_extract_names(raw_text: str) -> List[str]:
+        return corpus_names(raw_text, latency)
+
+    return [
+        compose(fake_google_extract_names, preprocess)
+        for preprocess in GOOGLE_PREPROCESSES
+    ]
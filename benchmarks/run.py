@@ -0,0 +1,212 @@
+"""
+Time each stage of extract_info separately on synthetic records, without the
+network, and write the timings as JSON so that they can be compared across
+commits.
+
+    python -m benchmarks.run [--records N] [--output FILE] [--google-latency S]
+
+Google is replaced by benchmarks.fake_google, and cached functions are called
+unwrapped, so that every call does the work. NLTK's stages are left out, and
+listed as skipped, if its models aren't installed. How long starting python and
+importing extract_info takes is timed too, in fresh interpreters.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, DefaultDict, Dict, List, Mapping, Optional
+from typing import TypeVar
+import nltk_models
+from benchmarks.bench_startup import startup
+from benchmarks.corpus import multilingual_records
+from benchmarks.fake_google import fake_google_extractors
+from extract_info import (
+    Entry,
+    extract_contacts,
+    min_max_names,
+    normalize_line,
+    space_dashes,
+    fuzzy_intersect,
+    search_names,
+    save_entries,
+    analyze_metrics,
+)
+from strategies import Extractors, Refiners, Stages, CRUDE_EXTRACTORS, REFINERS
+
+X = TypeVar("X")
+
+
+class Timings:
+    def __init__(self) -> None:
+        self.seconds: DefaultDict[str, float] = defaultdict(float)
+        self.calls: Counter = Counter()
+
+    def time(self, stage: str, func: Callable[..., X], *args: Any) -> X:
+        start = time.perf_counter()
+        result = func(*args)
+        self.seconds[stage] += time.perf_counter() - start
+        self.calls[stage] += 1
+        return result
+
+    def results(self) -> Dict[str, Mapping[str, float]]:
+        return {
+            stage: {
+                "calls": self.calls[stage],
+                "seconds": seconds,
+                "us_per_call": seconds / self.calls[stage] * 1e6,
+            }
+            for stage, seconds in self.seconds.items()
+        }
+
+
+def uncached(func: Callable[..., X]) -> Callable[..., X]:
+    return getattr(func, "__wrapped__", func)
+
+
+def available(resources: nltk_models.Resources) -> bool:
+    try:
+        nltk_models.ensure(resources, offline=True)
+    except LookupError:
+        return False
+    return True
+
+
+def offline_stages(google_latency: float) -> Stages:
+    "STAGES with fake google, and without what needs NLTK models we don't have."
+    crude_extractors: Extractors = CRUDE_EXTRACTORS
+    refiners: Refiners = REFINERS
+    if not available(nltk_models.NER_RESOURCES):
+        crude_extractors = [e for e in crude_extractors if "nltk" not in e.__name__]
+    if not (
+        os.path.exists(nltk_models.AMBIGUOUS_WORDS)
+        or available(nltk_models.WORDNET_RESOURCES)
+    ):
+        refiners = [r for r in refiners if "remove_synonyms" not in r.__name__]
+    return (fake_google_extractors(google_latency), crude_extractors, refiners)
+
+
+def time_stages(lines: List[str], stages: Stages, timings: Timings) -> List[Entry]:
+    "Time every stage on every line, returning what extract_info would have."
+    google_extractors, crude_extractors, refiners = (
+        list(map(uncached, stage)) for stage in stages
+    )
+    entries = []
+    for raw_line in lines:
+        line = normalize_line(raw_line)
+        emails, phones = timings.time("extract_contacts", extract_contacts, line)
+        min_names, max_names = min_max_names(emails, phones)
+        names = ["skipped"]
+        if max_names:
+            text = timings.time("space_dashes", space_dashes, line)
+            extractions = [
+                [
+                    timings.time(extractor.__name__, extractor, text)
+                    for extractor in stage
+                ]
+                for stage in (google_extractors, crude_extractors)
+            ]
+            for google_extraction in extractions[0]:
+                for crude_extraction in extractions[1]:
+                    consensus = timings.time(
+                        "fuzzy_intersect",
+                        fuzzy_intersect,
+                        google_extraction,
+                        crude_extraction,
+                    )
+                    for refine in refiners:
+                        timings.time(refine.__name__, refine, consensus)
+            uncached_stages: Any = (google_extractors, crude_extractors, refiners)
+            names = search_names(text, min_names, max_names, uncached_stages).names
+        entries.append(Entry([line], emails, phones, names))
+    return entries
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip()
+
+
+def run(
+    records: int,
+    seed: int = 0,
+    google_latency: float = 0.0,
+    **corpus_options: Any,
+) -> Dict[str, Any]:
+    lines = multilingual_records(records, seed, **corpus_options)
+    stages = offline_stages(google_latency)
+    timings = Timings()
+    start = time.perf_counter()
+    entries = time_stages(lines, stages, timings)
+    timings.time("save_entries", save_entries, entries, io.StringIO())
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings.time("analyze_metrics", analyze_metrics, entries)
+    total = time.perf_counter() - start
+    all_strategies = {
+        strategy.__name__
+        for stage in (CRUDE_EXTRACTORS, REFINERS)
+        for strategy in stage
+    }
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"records": records, "seed": seed, **corpus_options},
+        "google_latency": google_latency,
+        "seconds": total,
+        "records_per_second": records / total,
+        "skipped_stages": sorted(
+            all_strategies
+            - {strategy.__name__ for stage in stages for strategy in stage}
+        ),
+        "stages": timings.results(),
+        "startup": startup(repeat=3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-phones", type=int, default=2)
+    parser.add_argument("--email-rate", type=float, default=0.3)
+    parser.add_argument("--max-noise", type=int, default=2)
+    parser.add_argument(
+        "--google-latency",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="how long each fake google call takes (default: 0)",
+    )
+    parser.add_argument(
+        "--output", help="write the results to this file instead of stdout"
+    )
+    args = parser.parse_args()
+    results = run(
+        args.records,
+        args.seed,
+        args.google_latency,
+        max_phones=args.max_phones,
+        email_rate=args.email_rate,
+        max_noise=args.max_noise,
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
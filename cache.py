@@ -1,64 +1,925 @@
 from __future__ import division
+import os
+import re
+import sys
 import json
+import mmap
+import struct
+import inspect
+import hashlib
+import sqlite3
+import argparse
 import functools
-from collections import defaultdict
-from typing import List, Dict, Callable, Any, Union
+from collections import defaultdict, Counter, OrderedDict
+from typing import List, Dict, Callable, Iterable, Iterator, Tuple, Optional, Any
+from typing import Union
+from tables import format_table
+
+try:
+    from typing import Protocol
+except ImportError:  # before 3.8
+    from typing_extensions import Protocol  # type: ignore
+
+CacheEntries = Dict[str, Dict[str, Any]]
+CacheStats = Dict[str, Counter]
+StoredEntry = Tuple[str, str, Any]
+
+
+class Store(Protocol):
+    "Where Cache keeps results, as {(key, func_name): value}."
+
+    def get(self, key: str, func_name: str) -> Any:
+        "Raises KeyError if there is no entry."
+
+    def put(self, key: str, func_name: str, value: Any) -> None: ...
+
+    def delete(self, key: str, func_name: str) -> None: ...
+
+    def delete_func(self, func_name: str) -> None: ...
+
+    def delete_versions(self, func_name: str, keep: str = "") -> None:
+        "Delete the entries of every version of func_name but keep."
+
+    def results(self, key: str) -> Dict[str, Any]:
+        "Every function's result for key, as {func_name: value}."
+
+    def get_key_text(self, key: str) -> str:
+        "Raises KeyError if key's text wasn't kept."
+
+    def put_key_text(self, key: str, text: str) -> None: ...
+
+    def entries(self) -> Iterator[StoredEntry]: ...
+
+    def compact(self) -> None: ...
+
+    def close(self) -> None: ...
+
+
+# results are stored under a digest of the text (or JSON of the list) that was
+# passed to the cached function, and, when asked to keep it, the text itself is
+# kept apart from them so that keys can still be read when debugging. It's
+# sent back from workers, and written to cache.json, under this function name
+KEY_TEXT = "key_text"
+HASHED_KEY_RE = re.compile(r"[0-9a-f]{32}\Z")
+
+
+def hash_key(text: str) -> str:
+    return hashlib.blake2b(
+        text.encode("utf-8", "surrogatepass"), digest_size=16
+    ).hexdigest()
+
+
+def stored_key(key: str) -> str:
+    "Keys earlier versions stored verbatim, hashed, and hashed keys as they are."
+    return key if HASHED_KEY_RE.match(key) else hash_key(key)
+
+
+# cached functions store their results as e.g. only_alpha@1a2b3c4d, so that
+# editing a function stops its old results from being used
+VERSION_SEPARATOR = "@"
+VERSION_LENGTH = 8
+
+
+def function_version(func: Callable) -> str:
+    """
+    A digest of func's own source, or the cache_version it was given, or if
+    it's composed of other functions, e.g. by strategies.compose, and lists
+    them as its cache_parts, a digest of their versions.
+    """
+    version = getattr(func, "cache_version", None)
+    if version is not None:
+        return version
+    parts = getattr(func, "cache_parts", None)
+    if parts is not None:
+        return hash_key("".join(map(function_version, parts)))[:VERSION_LENGTH]
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        # e.g. defined in a REPL
+        source = func.__code__.co_code.hex()
+    return hash_key(source)[:VERSION_LENGTH]
+
+
+def untagged(func_name: str) -> str:
+    return func_name.split(VERSION_SEPARATOR, 1)[0]
+
+
+class MemoryStore:
+    "Not persisted at all, used until a Cache is loaded."
+
+    def __init__(self) -> None:
+        self.data: CacheEntries = defaultdict(dict)
+        self.key_texts: Dict[str, str] = {}
+
+    def get(self, key: str, func_name: str) -> Any:
+        return self.data[key][func_name]
+
+    def put(self, key: str, func_name: str, value: Any) -> None:
+        self.data[key][func_name] = value
+
+    def delete(self, key: str, func_name: str) -> None:
+        self.data.get(key, {}).pop(func_name, None)
+
+    def delete_func(self, func_name: str) -> None:
+        for item in self.data.values():
+            if func_name in item:
+                del item[func_name]
+
+    def delete_versions(self, func_name: str, keep: str = "") -> None:
+        prefix = func_name + VERSION_SEPARATOR
+        for item in self.data.values():
+            for stale in [name for name in item if name.startswith(prefix)]:
+                if stale != keep:
+                    del item[stale]
+
+    def results(self, key: str) -> Dict[str, Any]:
+        return dict(self.data.get(key, {}))
+
+    def get_key_text(self, key: str) -> str:
+        return self.key_texts[key]
+
+    def put_key_text(self, key: str, text: str) -> None:
+        self.key_texts[key] = text
+
+    def entries(self) -> Iterator[StoredEntry]:
+        for key, results in self.data.items():
+            for func_name, value in results.items():
+                yield key, func_name, value
+
+    def compact(self) -> None:
+        for key in [key for key, results in self.data.items() if not results]:
+            del self.data[key]
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStore(MemoryStore):
+    """
+    The original format: everything is read when opened and written when
+    closed, i.e. {text: {func1: result1, func2: result2}, text2: {...}, ...}
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        try:
+            data = json.load(open(path, encoding="utf-8"))
+        except IOError:
+            data = {}
+        for key, results in data.items():
+            if KEY_TEXT in results:
+                self.key_texts[stored_key(key)] = results.pop(KEY_TEXT)
+            self.data[stored_key(key)].update(results)
+
+    def close(self) -> None:
+        self.compact()
+        data = {key: dict(results) for key, results in self.data.items()}
+        for key, text in self.key_texts.items():
+            data.setdefault(key, {})[KEY_TEXT] = text
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+class SqliteStore:
+    """
+    Looks entries up as they're needed and commits each new one as soon as
+    it's stored, so neither startup time nor what a crash loses depends on
+    how big the cache is. Databases of earlier versions, with verbatim keys or
+    with key texts stored as entries, are migrated when opened, and marked with
+    a user_version of KEY_VERSION.
+    """
+
+    KEY_VERSION = 2
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            uri = "file:{}?mode=ro".format(path)
+            self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT, func_name TEXT, value TEXT, PRIMARY KEY (key, func_name))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS key_texts (key TEXT PRIMARY KEY, text TEXT)"
+        )
+        self.connection.commit()
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version < 1:
+            self._hash_keys()
+        if version < 2:
+            self._move_key_texts()
+
+    def _hash_keys(self) -> None:
+        with self.connection:
+            rows = self.connection.execute(
+                "SELECT key, func_name, value FROM entries"
+            ).fetchall()
+            for key, func_name, value in rows:
+                if stored_key(key) == key:
+                    continue
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                    (hash_key(key), func_name, value),
+                )
+                self.connection.execute(
+                    "DELETE FROM entries WHERE key = ? AND func_name = ?",
+                    (key, func_name),
+                )
+            self.connection.execute("PRAGMA user_version = 1")
+        # the verbatim keys were most of what was in there
+        self.compact()
+
+    def _move_key_texts(self) -> None:
+        with self.connection:
+            rows = self.connection.execute(
+                "SELECT key, value FROM entries WHERE func_name = ?", (KEY_TEXT,)
+            ).fetchall()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO key_texts VALUES (?, ?)",
+                [(key, json.loads(value)) for key, value in rows],
+            )
+            self.connection.execute(
+                "DELETE FROM entries WHERE func_name = ?", (KEY_TEXT,)
+            )
+            self.connection.execute("PRAGMA user_version = {}".format(self.KEY_VERSION))
+
+    def get(self, key: str, func_name: str) -> Any:
+        row = self.connection.execute(
+            "SELECT value FROM entries WHERE key = ? AND func_name = ?",
+            (key, func_name),
+        ).fetchone()
+        if row is None:
+            raise KeyError((key, func_name))
+        return json.loads(row[0])
+
+    def put(self, key: str, func_name: str, value: Any) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, func_name, json.dumps(value)),
+            )
+
+    def delete(self, key: str, func_name: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM entries WHERE key = ? AND func_name = ?", (key, func_name)
+            )
+
+    def delete_func(self, func_name: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM entries WHERE func_name = ?", (func_name,)
+            )
+
+    def delete_versions(self, func_name: str, keep: str = "") -> None:
+        # not LIKE, function names are full of underscores
+        prefix = func_name + VERSION_SEPARATOR
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM entries "
+                "WHERE substr(func_name, 1, ?) = ? AND func_name != ?",
+                (len(prefix), prefix, keep),
+            )
+
+    def results(self, key: str) -> Dict[str, Any]:
+        return {
+            func_name: json.loads(value)
+            for func_name, value in self.connection.execute(
+                "SELECT func_name, value FROM entries WHERE key = ?", (key,)
+            )
+        }
+
+    def get_key_text(self, key: str) -> str:
+        row = self.connection.execute(
+            "SELECT text FROM key_texts WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def put_key_text(self, key: str, text: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO key_texts VALUES (?, ?)", (key, text)
+            )
+
+    def entries(self) -> Iterator[StoredEntry]:
+        for key, func_name, value in self.connection.execute(
+            "SELECT key, func_name, value FROM entries ORDER BY key"
+        ):
+            yield key, func_name, json.loads(value)
+
+    def compact(self) -> None:
+        self.connection.execute("VACUUM")
+
+    def close(self) -> None:
+        if not self.read_only:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.connection.close()
+
+
+class Snapshot:
+    """
+    An immutable, memory-mapped file of entries with a hash index, written by
+    write_snapshot, so that every process looking things up in it shares one
+    copy through the page cache, and only decodes the values it's asked for.
+
+    The file is a header, a table of (fingerprint, record offset) slots that's
+    probed linearly from fingerprint % slots, the records, i.e. each key's
+    digest, the length of the function name and value, and the function name
+    and JSON value themselves, and finally a JSON list of every function name.
+    """
+
+    MAGIC = b"cachesn1"
+    # magic, number of slots, number of entries, where the function names are
+    HEADER = struct.Struct("<8sQQQ")
+    SLOT = struct.Struct("<QQ")
+    RECORD = struct.Struct("<16sHI")
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slots, self.count, self.func_names_offset = self.HEADER.unpack_from(
+            self.mmap
+        )
+        if magic != self.MAGIC:
+            raise ValueError("{} isn't a cache snapshot".format(path))
+        self.func_names = set(json.loads(self.mmap[self.func_names_offset :]))
+
+    @staticmethod
+    def fingerprint(key_digest: bytes, func_name: bytes) -> int:
+        digest = hashlib.blake2b(key_digest + func_name, digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def get(self, key: str, func_name: str) -> Any:
+        "Raises KeyError if there is no entry."
+        key_digest, name = bytes.fromhex(key), func_name.encode()
+        fingerprint = self.fingerprint(key_digest, name)
+        slot = fingerprint % self.slots
+        while True:
+            slot_fingerprint, offset = self.SLOT.unpack_from(
+                self.mmap, self.HEADER.size + slot * self.SLOT.size
+            )
+            # nothing's ever stored at 0, that's where the header is
+            if not offset:
+                raise KeyError((key, func_name))
+            if slot_fingerprint == fingerprint:
+                record_key, name_length, value_length = self.RECORD.unpack_from(
+                    self.mmap, offset
+                )
+                start = offset + self.RECORD.size
+                end = start + name_length
+                if record_key == key_digest and self.mmap[start:end] == name:
+                    return json.loads(self.mmap[end : end + value_length])
+            slot = (slot + 1) % self.slots
+
+    def entries(self) -> Iterator[StoredEntry]:
+        offset = self.HEADER.size + self.slots * self.SLOT.size
+        while offset < self.func_names_offset:
+            key_digest, name_length, value_length = self.RECORD.unpack_from(
+                self.mmap, offset
+            )
+            start = offset + self.RECORD.size
+            end = start + name_length
+            offset = end + value_length
+            yield (
+                key_digest.hex(),
+                self.mmap[start:end].decode(),
+                json.loads(self.mmap[end:offset]),
+            )
+
+    def close(self) -> None:
+        self.mmap.close()
+
+
+def write_snapshot(entries: Iterable[StoredEntry], path: str) -> None:
+    """
+    Write entries as a Snapshot. It's written next to path and then moved
+    there, so processes that have the old one open keep reading the old one.
+    """
+    records = {}
+    for key, func_name, value in entries:
+        name = func_name.encode()
+        records[bytes.fromhex(key), name] = json.dumps(value).encode()
+    # at most half full, so that probes stay short
+    slots = max(2 * len(records), 1)
+    table = [(0, 0)] * slots
+    offset = Snapshot.HEADER.size + slots * Snapshot.SLOT.size
+    body = []
+    for (key_digest, name), value in sorted(records.items()):
+        fingerprint = Snapshot.fingerprint(key_digest, name)
+        slot = fingerprint % slots
+        while table[slot][1]:
+            slot = (slot + 1) % slots
+        table[slot] = (fingerprint, offset)
+        record = Snapshot.RECORD.pack(key_digest, len(name), len(value))
+        body.append(record + name + value)
+        offset += len(body[-1])
+    func_names = sorted({name.decode() for _, name in records})
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(Snapshot.HEADER.pack(Snapshot.MAGIC, slots, len(records), offset))
+        for fingerprint, record_offset in table:
+            f.write(Snapshot.SLOT.pack(fingerprint, record_offset))
+        f.writelines(body)
+        f.write(json.dumps(func_names).encode())
+    os.replace(temporary_path, path)
+
+
+def overlay_path(snapshot_path: str) -> str:
+    return os.path.splitext(snapshot_path)[0] + ".overlay.sqlite3"
+
+
+class OverlayStore:
+    """
+    A read-only Snapshot, with whatever's stored or deleted since it was
+    written kept in a small SQLite overlay next to it, which is looked in
+    first. Entries of the snapshot that are deleted are listed in the overlay's
+    deletions table, with an empty key when every key's are. compact merges
+    the overlay into a new snapshot, and should only be run when no other
+    process is writing to the overlay.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.snapshot = Snapshot(path) if os.path.exists(path) else None
+        self.overlay = SqliteStore(overlay_path(path), read_only)
+        if not read_only:
+            with self.overlay.connection:
+                self.overlay.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS deletions "
+                    "(key TEXT, func_name TEXT, PRIMARY KEY (key, func_name))"
+                )
+        self.deletions = set(
+            self.overlay.connection.execute("SELECT key, func_name FROM deletions")
+        )
+
+    def _deleted(self, key: str, func_name: str) -> bool:
+        return (key, func_name) in self.deletions or ("", func_name) in self.deletions
+
+    def _delete_from_snapshot(self, key: str, func_name: str) -> None:
+        with self.overlay.connection:
+            self.overlay.connection.execute(
+                "INSERT OR IGNORE INTO deletions VALUES (?, ?)", (key, func_name)
+            )
+        self.deletions.add((key, func_name))
+
+    def get(self, key: str, func_name: str) -> Any:
+        try:
+            return self.overlay.get(key, func_name)
+        except KeyError:
+            if self.snapshot is None or self._deleted(key, func_name):
+                raise
+        return self.snapshot.get(key, func_name)
+
+    def put(self, key: str, func_name: str, value: Any) -> None:
+        self.overlay.put(key, func_name, value)
+
+    def delete(self, key: str, func_name: str) -> None:
+        self.overlay.delete(key, func_name)
+        if self.snapshot and func_name in self.snapshot.func_names:
+            self._delete_from_snapshot(key, func_name)
+
+    def delete_func(self, func_name: str) -> None:
+        self.overlay.delete_func(func_name)
+        if self.snapshot and func_name in self.snapshot.func_names:
+            self._delete_from_snapshot("", func_name)
+
+    def delete_versions(self, func_name: str, keep: str = "") -> None:
+        self.overlay.delete_versions(func_name, keep)
+        prefix = func_name + VERSION_SEPARATOR
+        for stale in self.snapshot.func_names if self.snapshot else ():
+            if stale.startswith(prefix) and stale != keep:
+                if ("", stale) not in self.deletions:
+                    self._delete_from_snapshot("", stale)
+
+    def results(self, key: str) -> Dict[str, Any]:
+        results = {}
+        for func_name in self.snapshot.func_names if self.snapshot else ():
+            try:
+                results[func_name] = self.get(key, func_name)
+            except KeyError:
+                pass
+        results.update(self.overlay.results(key))
+        return results
+
+    def get_key_text(self, key: str) -> str:
+        return self.overlay.get_key_text(key)
+
+    def put_key_text(self, key: str, text: str) -> None:
+        self.overlay.put_key_text(key, text)
+
+    def entries(self) -> Iterator[StoredEntry]:
+        overlaid = {(key, func_name) for key, func_name, _ in self.overlay.entries()}
+        if self.snapshot:
+            for key, func_name, value in self.snapshot.entries():
+                if (key, func_name) in overlaid or self._deleted(key, func_name):
+                    continue
+                yield key, func_name, value
+        yield from self.overlay.entries()
+
+    def compact(self) -> None:
+        write_snapshot(self.entries(), self.path)
+        if self.snapshot:
+            self.snapshot.close()
+        self.snapshot = Snapshot(self.path)
+        with self.overlay.connection:
+            self.overlay.connection.execute("DELETE FROM entries")
+            self.overlay.connection.execute("DELETE FROM deletions")
+        self.deletions = set()
+        self.overlay.compact()
+
+    def close(self) -> None:
+        if self.snapshot:
+            self.snapshot.close()
+        self.overlay.close()
+
+
+def open_store(path: str, read_only: bool = False) -> Store:
+    if path.endswith(".json"):
+        return JsonStore(path)
+    if path.endswith(".snapshot"):
+        return OverlayStore(path, read_only)
+    return SqliteStore(path, read_only)
+
+
+def import_json(store: Store, json_path: str) -> None:
+    "Add every entry of a cache.json file, with verbatim or hashed keys, to store."
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    for key, results in data.items():
+        for func_name, value in results.items():
+            if func_name == KEY_TEXT:
+                store.put_key_text(stored_key(key), value)
+            else:
+                store.put(stored_key(key), func_name, value)
+
+
+def export_json(store: Store, json_path: str) -> None:
+    "Write store out in the cache.json format."
+    data: CacheEntries = defaultdict(dict)
+    for key, func_name, value in store.entries():
+        data[key][func_name] = value
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def entry_size(key: str, value: Any) -> int:
+    "Rough number of bytes an entry takes up in memory."
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, list):
+        size += sum(map(sys.getsizeof, value))
+    return size
+
+
+class LruTier:
+    """
+    Recently used entries, in front of a Store. The least recently used ones
+    are evicted once there are more than max_entries or they take up more
+    than max_bytes; either limit can be None.
+    """
+
+    def __init__(self, max_entries: Optional[int], max_bytes: Optional[int]):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[Any, int]]" = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key: str, func_name: str) -> Any:
+        "Raises KeyError if the entry isn't in memory."
+        value, _ = self.entries[key, func_name]
+        self.entries.move_to_end((key, func_name))
+        return value
+
+    def put(self, key: str, func_name: str, value: Any) -> List[str]:
+        "Returns the func_name of each entry this evicted."
+        self.discard(key, func_name)
+        size = entry_size(key, value)
+        self.entries[key, func_name] = (value, size)
+        self.bytes += size
+        evicted = []
+        while self.entries and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            (_, evicted_func_name), (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            evicted.append(evicted_func_name)
+        return evicted
+
+    def discard(self, key: str, func_name: str) -> None:
+        if (key, func_name) in self.entries:
+            _, size = self.entries.pop((key, func_name))
+            self.bytes -= size
+
+    def discard_func(self, func_name: str) -> None:
+        for key, entry_func_name in list(self.entries):
+            if entry_func_name == func_name:
+                self.discard(key, entry_func_name)
+
+
+def format_stats(stats: CacheStats) -> str:
+    columns = ("hits", "memory_hits", "misses", "evictions")
+    return format_table("function", dict(sorted(stats.items())), columns)
+
 
 class Cache:
     """
     Non-functional persistent cache for storing expensive computation between runs.
 
-    Only stores the first argument and repeats it exactly once when saving
-    to disk, i.e. {text: {func1: result1, func2: result2}, text2: {...}, ...}
+    Only stores the first argument, and keeps results in a Store picked by the
+    cache name's extension: .json for the original load-everything format,
+    .snapshot for a memory-mapped Snapshot that processes share, with new
+    results in an OverlayStore, and anything else for an incrementally updated
+    SQLite database. Recently used
+    results are also kept in a bounded LruTier, and hits, misses and evictions
+    are counted for each cached function. Results are keyed by a hash of the
+    first argument, which is only kept as well with keep_key_text.
+
+    Wrapped functions store their results under their name tagged with their
+    function_version. Results of other versions are never looked up, and are
+    deleted when the cache is saved, for the functions that were used. Results
+    stored before versions were, untagged, are just as stale, unless the
+    function's version is pinned with with_cache(version=...), in which case
+    they're taken to be of that version.
     """
 
-    # maybe add cache hit/miss statistics in the future
-    def __init__(self, cache_name: str = "data/cache.json"):
+    def __init__(
+        self,
+        cache_name: str = "data/cache.sqlite3",
+        max_entries: Optional[int] = 100000,
+        max_bytes: Optional[int] = None,
+        keep_key_text: bool = False,
+    ):
         # this needs to be called before cached funcs are defined
         self.cache_name = cache_name
-        self.cache: Dict[str, Dict[str, str]]
+        self.keep_key_text = keep_key_text
+        self.store: Store = MemoryStore()
+        self.memory = LruTier(max_entries, max_bytes)
+        self.stats: CacheStats = defaultdict(Counter)
+        # in worker processes, entries computed since the last pop_new_entries,
+        # so that they can be shipped back to the parent's cache
+        self.new_entries: CacheEntries = defaultdict(dict)
+        self.worker = False
+        self.inherited_store: Store = self.store
+        # called with the function name and whether it was a hit, e.g. by tracing
+        self.on_lookup: Optional[Callable[[str, bool], None]] = None
+        # each wrapped function, and the name its results are stored under, which
+        # is only worked out when it's first needed since reading source isn't free
+        self.cached_funcs: Dict[str, Callable] = {}
+        self.versions: Dict[str, str] = {}
+        # the one version to keep of results that are put rather than wrapped
+        self.kept_versions: Dict[str, str] = {}
 
     def __enter__(self) -> None:
+        self.load()
+
+    def load(self, worker: bool = False) -> None:
         # this only needs to be called before cached funcs are called
-        try:
-            data = json.load(open(self.cache_name, encoding="utf-8"))
-        except IOError:
-            data = {}
-        self.cache = defaultdict(dict, data)
+        legacy_cache_name = os.path.splitext(self.cache_name)[0] + ".json"
+        if not os.path.exists(self.cache_name) and os.path.exists(legacy_cache_name):
+            # start from the cache.json that earlier versions left behind
+            store = open_store(self.cache_name)
+            import_json(store, legacy_cache_name)
+            store.close()
+        if worker:
+            # a forked worker mustn't use or even close the parent's connection
+            self.inherited_store = self.store
+        # workers only read, their new entries go back through the parent
+        self.store = open_store(self.cache_name, read_only=worker)
+        self.memory = LruTier(self.memory.max_entries, self.memory.max_bytes)
+        self.new_entries = defaultdict(dict)
+        self.stats = defaultdict(Counter)
+        self.kept_versions = {}
+        self.worker = worker
 
     def __exit__(self, *exception_info: Any) -> None:
-        with open(self.cache_name, "w", encoding="utf-8") as f:
-            json.dump(dict(self.cache), f)
+        kept_versions = dict(self.kept_versions)
+        for func_name in self.stats:
+            if func_name in self.cached_funcs:
+                kept_versions[func_name] = self.tagged(func_name)
+                if not self.pinned(func_name):
+                    self.store.delete_func(func_name)
+        for func_name, tagged_func_name in kept_versions.items():
+            self.store.delete_versions(func_name, keep=tagged_func_name)
+        self.store.close()
+        self.store = MemoryStore()
         print("saved cache")
+        if self.stats:
+            print(format_stats(self.stats))
+
+    def resize(self, max_entries: Optional[int], max_bytes: Optional[int]) -> None:
+        self.memory = LruTier(max_entries, max_bytes)
+
+    def pop_stats(self) -> CacheStats:
+        stats, self.stats = self.stats, defaultdict(Counter)
+        return dict(stats)
+
+    def merge_stats(self, stats: CacheStats) -> None:
+        "Add counts from elsewhere, e.g. a worker process."
+        for func_name, counts in stats.items():
+            self.stats[func_name].update(counts)
+
+    def pop_new_entries(self) -> CacheEntries:
+        new_entries, self.new_entries = self.new_entries, defaultdict(dict)
+        return dict(new_entries)
+
+    def merge(self, entries: CacheEntries) -> None:
+        "Add entries computed elsewhere, e.g. by a worker process."
+        for key, results in entries.items():
+            for func_name, value in results.items():
+                if func_name == KEY_TEXT:
+                    self.store.put_key_text(key, value)
+                else:
+                    self.store.put(key, func_name, value)
 
     def clear_cache(self, func_name: str) -> None:
-        for item in self.cache.values():
-            if func_name in item:
-                del item[func_name]
+        self.memory.discard_func(self.tagged(func_name))
+        self.store.delete_func(func_name)
+        self.store.delete_versions(func_name)
+
+    def keep_version(self, tagged_func_name: str) -> None:
+        """
+        Delete the results of other versions when the cache is saved, like those
+        of wrapped functions, for results that are put, e.g. extract_info's entries.
+        """
+        self.kept_versions[untagged(tagged_func_name)] = tagged_func_name
+
+    def tagged(self, func_name: str) -> str:
+        "What func_name's results are stored as."
+        tagged_func_name = self.versions.get(func_name)
+        if tagged_func_name is None:
+            func = self.cached_funcs.get(func_name)
+            if func is None:
+                return func_name
+            tagged_func_name = func_name + VERSION_SEPARATOR + function_version(func)
+            self.versions[func_name] = tagged_func_name
+        return tagged_func_name
 
-    def with_cache(self, func: Callable) -> Callable:
+    @staticmethod
+    def key_text(arg1: Union[str, List[str]]) -> str:
+        if isinstance(arg1, list):
+            return json.dumps(arg1)
+        return arg1
+
+    @staticmethod
+    def make_key(arg1: Union[str, List[str]]) -> str:
+        return hash_key(Cache.key_text(arg1))
+
+    def _remember(self, key: str, func_name: str, value: Any) -> None:
+        for evicted_func_name in self.memory.put(key, func_name, value):
+            self.stats[untagged(evicted_func_name)]["evictions"] += 1
+
+    def _get(self, key: str, func_name: str) -> Tuple[Any, bool]:
+        "Returns the value and whether it was in memory, or raises KeyError."
+        tagged_func_name = self.tagged(func_name)
+        if self.worker and tagged_func_name in self.new_entries.get(key, ()):
+            return self.new_entries[key][tagged_func_name], True
+        try:
+            return self.memory.get(key, tagged_func_name), True
+        except KeyError:
+            pass
+        try:
+            value = self.store.get(key, tagged_func_name)
+        except KeyError:
+            if not self.pinned(func_name):
+                raise
+            value = self._adopt(key, func_name)
+        self._remember(key, tagged_func_name, value)
+        return value, False
+
+    def pinned(self, func_name: str) -> bool:
+        "Whether func_name's version is fixed rather than changing with its source."
+        func = self.cached_funcs.get(func_name)
+        return getattr(func, "cache_version", None) is not None
+
+    def _adopt(self, key: str, func_name: str) -> Any:
+        "Tag a result stored before versions were, or raise KeyError."
+        value = self.store.get(key, func_name)
+        if self.worker:
+            self.new_entries[key][self.tagged(func_name)] = value
+        else:
+            self.store.put(key, self.tagged(func_name), value)
+            self.store.delete(key, func_name)
+        return value
+
+    def get(self, arg1: Union[str, List[str]], func_name: str) -> Any:
+        "Raises KeyError if nothing is cached."
+        return self._get(self.make_key(arg1), func_name)[0]
+
+    def contains(self, arg1: Union[str, List[str]], func_name: str) -> bool:
+        try:
+            self.get(arg1, func_name)
+        except KeyError:
+            return False
+        return True
+
+    def put(self, arg1: Union[str, List[str]], func_name: str, value: Any) -> None:
+        "Store a result computed outside of the wrapped function, e.g. in a batch."
+        key = self.make_key(arg1)
+        func_name = self.tagged(func_name)
+        if self.worker:
+            self.new_entries[key][func_name] = value
+        else:
+            self.store.put(key, func_name, value)
+            self._remember(key, func_name, value)
+        if self.keep_key_text:
+            if self.worker:
+                self.new_entries[key][KEY_TEXT] = self.key_text(arg1)
+            else:
+                self.store.put_key_text(key, self.key_text(arg1))
+
+    def delete(self, arg1: Union[str, List[str]], func_name: str) -> None:
+        key = self.make_key(arg1)
+        func_name = self.tagged(func_name)
+        self.new_entries.get(key, {}).pop(func_name, None)
+        self.memory.discard(key, func_name)
+        self.store.delete(key, func_name)
+
+    def with_cache(
+        self, func: Optional[Callable] = None, *, version: Optional[str] = None
+    ) -> Callable:
+        """
+        Use as @cache.with_cache, or as @cache.with_cache(version=...) to store
+        results under a fixed version rather than one that changes with the source.
+        """
+        if func is None:
+            return functools.partial(self.with_cache, version=version)
         func_name = func.__name__
 
         @functools.wraps(func)
         def wrapper(arg1: Union[str, List[str]], *args: Any, **kwargs: Any) -> Any:
-            if isinstance(arg1, list):
-                key = json.dumps(arg1)
-            else:
-                key = arg1
+            counts = self.stats[func_name]
             try:
-                return self.cache[key][func_name]
+                value, in_memory = self._get(self.make_key(arg1), func_name)
             except KeyError:
-                pass
+                counts["misses"] += 1
+                if self.on_lookup:
+                    self.on_lookup(func_name, False)
+            else:
+                counts["hits"] += 1
+                counts["memory_hits"] += in_memory
+                if self.on_lookup:
+                    self.on_lookup(func_name, True)
+                return value
             value = func(arg1, *args, **kwargs)
             # nice-to-have: allow a default value to be returned in case
             # of errors, and don't store that (instead of current impl
             # where the function has to catch its error and that defaut is
             # cached)
-            self.cache[key][func_name] = value
+            self.put(arg1, func_name, value)
             return value
 
+        if version is not None:
+            wrapper.cache_version = version  # type: ignore
+        self.cached_funcs[func_name] = wrapper
+        self.versions.pop(func_name, None)
         return wrapper
 
 
 cache = Cache()
 
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Maintain the persistent cache")
+    parser.add_argument("--cache", default=cache.cache_name, help="cache to work on")
+    parser.add_argument("--import-json", metavar="PATH", help="add a cache.json")
+    parser.add_argument("--export-json", metavar="PATH", help="write a cache.json")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="reclaim space, and merge a snapshot's overlay into it",
+    )
+    parser.add_argument(
+        "--snapshot", metavar="PATH", help="write a read-only .snapshot of the cache"
+    )
+    parser.add_argument(
+        "--lookup", metavar="TEXT", help="print what's cached for a function's input"
+    )
+    args = parser.parse_args(argv)
+    store = open_store(args.cache)
+    if args.lookup is not None:
+        results = store.results(hash_key(args.lookup))
+        for func_name, value in sorted(results.items()):
+            print("{}: {}".format(func_name, json.dumps(value, ensure_ascii=False)))
+    if args.import_json:
+        import_json(store, args.import_json)
+    if args.export_json:
+        export_json(store, args.export_json)
+    if args.compact:
+        store.compact()
+    if args.snapshot:
+        write_snapshot(store.entries(), args.snapshot)
+    store.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,195 @@
+"""
+Score every path through the strategies, each google extractor with each crude
+extractor and each refiner, against data/examples.json and
+data/counterexamples.json in one pass, instead of editing STAGES and rerunning
+everything for each combination to compare.
+
+    python -m evaluate [--output PATH] [--json] [--spacy-model MODEL]
+
+Each record's extractions, consensuses and refinements are only computed once,
+and shared by every path they're on. A path's result is what extract_info would
+return if its stages were only that path, and the "search" row is what
+extract_names returns with all of them. With a spaCy model, it's scored as
+another google extractor, to see whether it could stand in for Google.
+"""
+import sys
+import json
+import argparse
+from itertools import product
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+import numpy as np
+from cache import cache
+from tables import format_table
+from extract_info import (
+    Entry,
+    EntryMapping,
+    Names,
+    extract_contacts,
+    extract_names,
+    fuzzy_intersect,
+    min_max_names,
+    normalize_line,
+    space_dashes,
+)
+from strategies import Stages, STAGES
+from backends import SpacyBackend, as_extractor
+
+SEARCH = "search"
+
+
+def path_labels(stages: Stages = STAGES) -> List[str]:
+    "What evaluate_line's entries are for, in order."
+    names = ([strategy.__name__ for strategy in stage] for stage in stages)
+    return [" > ".join(path) for path in product(*names)] + [SEARCH]
+
+
+def evaluate_line(raw_line: str, stages: Stages = STAGES) -> List[Entry]:
+    "The entry each of path_labels would extract from raw_line."
+    line = normalize_line(raw_line)
+    emails, phones = extract_contacts(line)
+    min_names, max_names = min_max_names(emails, phones)
+    google_extractors, crude_extractors, refiners = stages
+    if not max_names:
+        return [Entry([line], emails, phones, ["skipped"]) for _ in path_labels(stages)]
+    text = space_dashes(line)
+    google_extractions, crude_extractions = (
+        [extractor(text) for extractor in extractors]
+        for extractors in (google_extractors, crude_extractors)
+    )
+    consensuses: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], Names] = {}
+    refinements: Dict[Tuple[int, Tuple[str, ...]], Names] = {}
+
+    def usable(extraction: Names) -> Names:
+        # search_names uses nothing instead of extractions with too few names
+        return extraction if len(extraction) >= min_names else []
+
+    def consensus(google_extraction: Names, crude_extraction: Names) -> Names:
+        extractions = (tuple(google_extraction), tuple(crude_extraction))
+        if extractions not in consensuses:
+            consensuses[extractions] = fuzzy_intersect(
+                google_extraction, crude_extraction
+            )
+        return consensuses[extractions]
+
+    def accepted(refiner_number: int, names: Names) -> Names:
+        "The refinement if it has min_names to max_names names, or nothing."
+        if len(names) < min_names:
+            return []
+        refined = (refiner_number, tuple(names))
+        if refined not in refinements:
+            refinements[refined] = refiners[refiner_number](names)
+        if min_names <= len(refinements[refined]) <= max_names:
+            return refinements[refined]
+        return []
+
+    names_by_path = [
+        accepted(refiner_number, consensus(usable(google), usable(crude)))
+        for google, crude, refiner_number in product(
+            google_extractions, crude_extractions, range(len(refiners))
+        )
+    ]
+    names_by_path.append(extract_names(text, min_names, max_names, stages))
+    return [Entry([line], emails, phones, names) for names in names_by_path]
+
+
+class Evaluation(NamedTuple):
+    paths: List[str]
+    # the fraction of examples each path extracts exactly
+    correct: np.ndarray
+    # the fraction of counterexamples, known wrong entries, each path repeats
+    incorrect: np.ndarray
+    examples: int
+    counterexamples: int
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "examples": self.examples,
+            "counterexamples": self.counterexamples,
+            "paths": {
+                path: {"correct": float(correct), "incorrect": float(incorrect)}
+                for path, correct, incorrect in zip(
+                    self.paths, self.correct, self.incorrect
+                )
+            },
+        }
+
+    def format(self) -> str:
+        # best first
+        rows = {
+            self.paths[number]: {
+                "correct": self.correct[number],
+                "incorrect": self.incorrect[number],
+            }
+            for number in np.lexsort((self.incorrect, -self.correct))
+        }
+        return "\n".join(
+            [
+                "{} examples, {} counterexamples".format(
+                    self.examples, self.counterexamples
+                ),
+                format_table("path", rows, ("correct", "incorrect"), "{:>11.2%}"),
+            ]
+        )
+
+
+def evaluate(
+    examples: Sequence[EntryMapping],
+    counterexamples: Sequence[EntryMapping],
+    stages: Stages = STAGES,
+) -> Evaluation:
+    paths = path_labels(stages)
+    labeled = list(examples) + list(counterexamples)
+    # whether each path's entry is each labeled entry
+    matches = np.zeros((len(labeled), len(paths)), dtype=bool)
+    for row, entry in enumerate(labeled):
+        matches[row] = [
+            path_entry == entry
+            for path_entry in evaluate_line(entry["line"][0], stages)
+        ]
+    example_matches = matches[: len(examples)]
+    counterexample_matches = matches[len(examples) :]
+    return Evaluation(
+        paths,
+        example_matches.sum(axis=0) / max(len(examples), 1),
+        counterexample_matches.sum(axis=0) / max(len(counterexamples), 1),
+        len(examples),
+        len(counterexamples),
+    )
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Score every path through STAGES")
+    parser.add_argument("--examples", default="data/examples.json")
+    parser.add_argument("--counterexamples", default="data/counterexamples.json")
+    parser.add_argument("--json", action="store_true", help="write JSON")
+    parser.add_argument(
+        "--output", help="write the table to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--spacy-model", metavar="MODEL", help="score this spaCy model too"
+    )
+    args = parser.parse_args(argv)
+    stages = STAGES
+    if args.spacy_model:
+        google_extractors, crude_extractors, refiners = STAGES
+        spacy_extractor = as_extractor(SpacyBackend(args.spacy_model))
+        stages = ([*google_extractors, spacy_extractor], crude_extractors, refiners)
+    with open(args.examples, encoding="utf-8") as f:
+        examples = json.load(f)
+    with open(args.counterexamples, encoding="utf-8") as f:
+        counterexamples = json.load(f)
+    with cache:
+        evaluation = evaluate(examples, counterexamples, stages)
+    if args.json:
+        table = json.dumps(evaluation.as_dict(), indent=2)
+    else:
+        table = evaluation.format()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(table + "\n")
+    else:
+        print(table)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,29 +2,146 @@ from __future__ import division
 import sys
 import csv
 import re
+import json
+import argparse
+import threading
+import contextlib
 from enum import Enum
-from itertools import zip_longest
-from typing import List, Mapping, Tuple, Sequence, Iterator, IO, Any
-from phonenumbers import PhoneNumberMatcher, format_number, PhoneNumberFormat
-from strategies import Stages, STAGES
-from cache import cache
+from functools import partial, lru_cache
+from bisect import bisect_right
+from collections import deque
+from itertools import zip_longest, islice, accumulate
+from typing import List, Dict, Set, Mapping, Tuple, Sequence, Iterable, Iterator, IO
+from typing import Any, Callable, NamedTuple, Optional, Pattern, TypeVar, TYPE_CHECKING
+from strategies import (
+    Extractors,
+    Stages,
+    STAGES,
+    google_prefetch_requests,
+    nltk_extract_names_many,
+)
+from cache import (
+    cache,
+    function_version,
+    hash_key,
+    CacheEntries,
+    CacheStats,
+    VERSION_SEPARATOR,
+)
+from scheduler import scheduler, SchedulerStats, MODES
+from tracing import tracer, read_trace, Record
+from tables import format_table
+import nltk_models
+import backends
 
+# numpy, phonenumbers, google_client and multiprocessing are imported when
+# they're first needed, since a run that's served from the cache may not need them
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    import numpy as np
+    from phonenumbers import PhoneNumber
+    from google_client import LanguageClient
+
+X = TypeVar("X")
 Names = List[str]
-NameAttempts = Iterator[Names]
-Entry = Mapping[str, Names]
+NameAttempts = Iterator[Tuple[str, Names]]
+
+
+class Entry(Mapping[str, Names]):
+    """
+    What was extracted from a record. Slotted rather than a dict, since there
+    can be a lot of them, but still a mapping from each of FIELDS to its
+    values, so it's equal to the dict it used to be.
+    """
+
+    FIELDS = ("line", "emails", "phones", "names")
+    __slots__ = FIELDS
+
+    def __init__(self, line: Names, emails: Names, phones: Names, names: Names):
+        self.line = line
+        self.emails = emails
+        self.phones = phones
+        self.names = names
+
+    def __getitem__(self, field: str) -> Names:
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def __repr__(self) -> str:
+        return "Entry({!r}, {!r}, {!r}, {!r})".format(*self.values())
+
+    def __reduce__(self) -> Tuple[type, Tuple[Names, ...]]:
+        # smaller and quicker to send back from workers than the default
+        return (Entry, tuple(self.values()))
+
+
+# entries, or the dicts they're equal to, e.g. examples
+EntryMapping = Mapping[str, Names]
 
 
 EMAIL_RE = re.compile(r"[\w\.-]+@[\w\.-]+")
+# the shortest valid numbers, e.g. +43 1234, have 6 digits counting the country code
+MIN_PHONE_DIGITS = 6
+PHONE_NUMBER_FIELDS = (
+    "country_code",
+    "national_number",
+    "extension",
+    "italian_leading_zero",
+    "number_of_leading_zeros",
+)
+
+
+@lru_cache(maxsize=None)
+def phone_digits_re() -> Pattern[str]:
+    """
+    PhoneNumberMatcher only looks at runs of digits separated by at most 4 of
+    the characters phonenumbers allows between them.
+    """
+    from phonenumbers.phonenumberutil import _VALID_PUNCTUATION
+
+    return re.compile(r"\d+(?:[{}]{{0,4}}\d+)*".format(_VALID_PUNCTUATION))
+
+
+def could_have_phones(line: str) -> bool:
+    "Cheaply rule out lines PhoneNumberMatcher can't find a valid number in."
+    if sum(map(str.isdecimal, line)) < MIN_PHONE_DIGITS:
+        return False
+    return any(
+        sum(map(str.isdecimal, digits)) >= MIN_PHONE_DIGITS
+        for digits in phone_digits_re().findall(line)
+    )
+
+
+@lru_cache(maxsize=4096)
+def _format_phone(number_fields: Tuple[Any, ...]) -> str:
+    from phonenumbers import PhoneNumber, PhoneNumberFormat, format_number
+
+    number = PhoneNumber(**dict(zip(PHONE_NUMBER_FIELDS, number_fields)))
+    return format_number(number, PhoneNumberFormat.INTERNATIONAL)
+
+
+def format_phone(number: "PhoneNumber") -> str:
+    # PhoneNumbers aren't hashable, but these are all formatting looks at
+    return _format_phone(tuple(getattr(number, field) for field in PHONE_NUMBER_FIELDS))
 
 
 def extract_contacts(line: str) -> Tuple[List[str], List[str]]:
-    emails = EMAIL_RE.findall(line)
+    emails = EMAIL_RE.findall(line) if "@" in line else []
     # "how hard can it be to write a regex to match phone numbers?"
     # way too hard for international formats, as it turns out
-    phones = [
-        format_number(match.number, PhoneNumberFormat.INTERNATIONAL)
-        for match in PhoneNumberMatcher(line, "US")
-    ] 
+    phones = []
+    if could_have_phones(line):
+        from phonenumbers import PhoneNumberMatcher
+
+        matches = PhoneNumberMatcher(line, "US")
+        phones = [format_phone(match.number) for match in matches]
     return emails, phones
 
 
@@ -41,7 +158,92 @@ def min_max_names(emails: List[str], phones: List[str]) -> Tuple[int, int]:
     return (min_names, max_names)
 
 
-def fuzzy_intersect(left: Names, right: Names, recursive: bool = False) -> Names:
+class NameIndex:
+    """
+    The names that haven't been set aside yet, indexed so that finding the ones
+    a name contains or is contained by doesn't mean comparing it with every one.
+
+    Names containing a name are found by searching all of them joined together,
+    names contained in a name with an Aho-Corasick automaton over all of them.
+    Building those only pays off for longer lists, so short ones are scanned.
+    """
+
+    min_indexed_names = 128
+    separator = "\0"
+
+    def __init__(self, names: Names):
+        self.names = names
+        self.alive = [True] * len(names)
+        self.indexed = len(names) >= self.min_indexed_names and not any(
+            self.separator in name for name in names
+        )
+        if self.indexed:
+            self._build()
+
+    def _build(self) -> None:
+        self.joined = self.separator.join(self.names)
+        self.starts = list(accumulate([0] + [len(name) + 1 for name in self.names]))
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail = [0]
+        self.outputs: List[List[int]] = [[]]
+        for position, name in enumerate(self.names):
+            node = 0
+            for char in name:
+                if char not in self.goto[node]:
+                    self.goto[node][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                node = self.goto[node][char]
+            self.outputs[node].append(position)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child].extend(self.outputs[self.fail[child]])
+
+    def _contained_in(self, name: str) -> Set[int]:
+        node = 0
+        positions = set(self.outputs[0])
+        for char in name:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            positions.update(self.outputs[node])
+        return positions
+
+    def _containing(self, name: str) -> Set[int]:
+        positions = set()
+        offset = self.joined.find(name)
+        while offset != -1:
+            position = bisect_right(self.starts, offset) - 1
+            positions.add(position)
+            # any more occurrences in this name would only find it again
+            offset = self.joined.find(name, self.starts[position + 1])
+        return positions
+
+    def related(self, name: str) -> List[int]:
+        "Positions of the remaining names that contain or are contained by name."
+        if not self.indexed or not name or self.separator in name:
+            return [
+                position
+                for position, other in enumerate(self.names)
+                if self.alive[position] and (other in name or name in other)
+            ]
+        positions = self._contained_in(name) | self._containing(name)
+        return sorted(position for position in positions if self.alive[position])
+
+    def discard(self, positions: Iterable[int]) -> None:
+        for position in positions:
+            self.alive[position] = False
+
+
+def fuzzy_intersect(left: Names, right: Names) -> Names:
     """
     Take the first name on the left, if it contains or is contained by a name
     on the right, set aside all of the names on the left or right that the first
@@ -50,67 +252,96 @@ def fuzzy_intersect(left: Names, right: Names, recursive: bool = False) -> Names
 
     If either left or right are empty, return the other one.
     """
-    if recursive:
-        if not left:
-            return []
-    else:
-        if not (left and right):
-            return left or right
-    first_left, *remaining_left = left
-    similar_right = set(
-        right_name
-        for right_name in right
-        if right_name in first_left or first_left in right_name
-    )
-    if similar_right:
+    if not (left and right):
+        return left or right
+    left_index, right_index = NameIndex(left), NameIndex(right)
+    intersections: Names = []
+    for position, first_left in enumerate(left):
+        if not left_index.alive[position]:
+            continue
+        left_index.discard([position])
+        similar_right = right_index.related(first_left)
+        if not similar_right:
+            continue
+        if not intersections:
+            # from the first match on, repeated names on the left only count once
+            remaining_left = range(position + 1, len(left))
+            first_positions = {left[index]: index for index in reversed(remaining_left)}
+            left_index.discard(set(remaining_left) - set(first_positions.values()))
         # catch duplicate similar names
-        also_similar_left = set(
-            left_name
-            for left_name in remaining_left
-            if left_name in first_left or first_left in left_name
-        )
-        intersection = max(first_left, *similar_right, *also_similar_left, key=len)
-        dissimilar_right = list(set(right) - similar_right)
-        dissimilar_left = list(set(remaining_left) - also_similar_left)
-        return [intersection] + fuzzy_intersect(dissimilar_left, dissimilar_right, True)
-    return fuzzy_intersect(remaining_left, right, recursive=True)
+        also_similar_left = left_index.related(first_left)
+        similar_names = [right[index] for index in similar_right] + [
+            left[index] for index in also_similar_left
+        ]
+        intersections.append(max(first_left, *similar_names, key=len))
+        right_index.discard(similar_right)
+        left_index.discard(also_similar_left)
+    return intersections
 
 
-def extract_names(
+class SearchResult(NamedTuple):
+    names: Names
+    # how many extractors and refiners were called
+    evaluations: int
+    # the names of the google extractor, crude extractor and refiner that found
+    # names, with "" for an extraction stage where nothing had min_names names
+    path: Tuple[str, ...]
+
+
+def search_names(
     text: str, min_names: int, max_names: int, stages: Stages = STAGES
-) -> Names:
-    def filter_min_criteria(attempts: NameAttempts) -> NameAttempts:
+) -> SearchResult:
+    """
+    Try each google extraction with each crude extraction and each refiner, in
+    that order, and return the first refinement with min_names to max_names names.
+
+    Each pair of extractions and each consensus is only refined once per
+    record, and since refiners only ever remove names, consensuses with fewer
+    than min_names names aren't refined at all.
+    """
+    evaluations = 0
+
+    def filter_min_criteria(extractors: Extractors) -> NameAttempts:
+        nonlocal evaluations
         yielded_anything = False
-        for attempt in attempts:
+        for extractor in extractors:
+            evaluations += 1
+            with tracer.stage(extractor.__name__):
+                attempt = extractor(text)
             if len(attempt) >= min_names:
                 yielded_anything = True
-                yield attempt
+                yield extractor.__name__, attempt
         if not yielded_anything:
-            yield []
+            yield "", []
 
     google_extractors, crude_extractors, refiners = stages
-    google_extractions: Iterator[Names] = filter_min_criteria(
-        extractor(text) for extractor in google_extractors
-    )
-    crude_extractions: Iterator[Names] = filter_min_criteria(
-        extractor(text) for extractor in crude_extractors
-    )
-    consensuses = (
-        fuzzy_intersect(google_extraction, crude_extraction)
-        for google_extraction in google_extractions
-        for crude_extraction in crude_extractions
-    )
-    refinements = (
-        refine(consensus) for consensus in consensuses for refine in refiners
-    )
-    try:
-        return next(
-            refinement
-            for refinement in refinements
-            if min_names <= len(refinement) <= max_names
-        )
-    except StopIteration:
-        return []
+    seen_extractions: Set[Tuple[Tuple[str, ...], Tuple[str, ...]]] = set()
+    seen_consensuses: Set[Tuple[str, ...]] = set()
+    for google_name, google_extraction in filter_min_criteria(google_extractors):
+        for crude_name, crude_extraction in filter_min_criteria(crude_extractors):
+            extractions = (tuple(google_extraction), tuple(crude_extraction))
+            if extractions in seen_extractions:
+                continue
+            seen_extractions.add(extractions)
+            with tracer.stage("fuzzy_intersect"):
+                consensus = fuzzy_intersect(google_extraction, crude_extraction)
+            if len(consensus) < min_names or tuple(consensus) in seen_consensuses:
+                continue
+            seen_consensuses.add(tuple(consensus))
+            for refine in refiners:
+                evaluations += 1
+                with tracer.stage(refine.__name__):
+                    refinement = refine(consensus)
+                if min_names <= len(refinement) <= max_names:
+                    path = (google_name, crude_name, refine.__name__)
+                    return SearchResult(refinement, evaluations, path)
+    return SearchResult([], evaluations, ())
+
+
+def extract_names(
+    text: str, min_names: int, max_names: int, stages: Stages = STAGES
+) -> Names:
+    return search_names(text, min_names, max_names, stages).names
 
 
 def space_dashes(text: str) -> str:
@@ -118,27 +349,321 @@ def space_dashes(text: str) -> str:
     return re.sub(r"-([^ -])", r"- \1", re.sub(r"([^ -])-", r"\1 -", text))
 
 
-def extract_info(raw_line: str, **extract_names_kwargs: Any) -> Mapping[str, List[str]]:
-    line = raw_line.replace("'", "").replace("\n", "")
-    emails, phones = extract_contacts(line)
-    min_names, max_names = min_max_names(emails, phones)
-    if max_names == 0:
-        names = ["skipped"]
-    else:
-        clean_line = space_dashes(line)
-        names = extract_names(clean_line, min_names, max_names, **extract_names_kwargs)
-        print(".", end="")
-        sys.stdout.flush()
-    return {"line": [line], "emails": emails, "phones": phones, "names": names}
+def normalize_line(raw_line: str) -> str:
+    return raw_line.replace("'", "").replace("\n", "")
+
+
+def extract_info(raw_line: str, **extract_names_kwargs: Any) -> Entry:
+    "Strategies are tried in the scheduler's order unless stages are given."
+    with tracer.record():
+        line = normalize_line(raw_line)
+        with tracer.stage("extract_contacts"):
+            emails, phones = extract_contacts(line)
+        min_names, max_names = min_max_names(emails, phones)
+        path: Tuple[str, ...] = ()
+        evaluations = 0
+        if max_names == 0:
+            names = ["skipped"]
+        else:
+            with tracer.stage("space_dashes"):
+                clean_line = space_dashes(line)
+            search_kwargs = {"stages": scheduler.stages(), **extract_names_kwargs}
+            names, evaluations, path = search_names(
+                clean_line, min_names, max_names, **search_kwargs
+            )
+            print(".", end="")
+            sys.stdout.flush()
+        entry = Entry([line], emails, phones, names)
+        scheduler.record(path, EntryType.correct in decide_entry_type(entry))
+        tracer.annotate(line=line, path=path, evaluations=evaluations)
+    return entry
+
+
+def windows(items: Iterable[X], size: int) -> Iterator[List[X]]:
+    remaining_items = iter(items)
+    return iter(lambda: list(islice(remaining_items, size)), [])
+
+
+GoogleRequests = List[Tuple[str, str, str]]
+
+
+def texts_to_extract(raw_lines: Iterable[str]) -> List[str]:
+    "Return the text extract_info looks for names in, for each line it doesn't skip."
+    texts = []
+    for raw_line in raw_lines:
+        line = normalize_line(raw_line)
+        if min_max_names(*extract_contacts(line))[1]:
+            texts.append(space_dashes(line))
+    return texts
+
+
+def _google_requests(raw_lines: Iterable[str]) -> GoogleRequests:
+    "Return (text, extractor name, preprocessed text) that extract_info would need."
+    return [
+        (text, extractor_name, preprocessed)
+        for text in texts_to_extract(raw_lines)
+        for extractor_name, preprocessed in google_prefetch_requests(text)
+    ]
+
+
+def with_google_prefetch(
+    lines: Iterable[str], client: "LanguageClient", lookahead: int = 32
+) -> Iterator[str]:
+    """
+    Yield lines unchanged, but only after the google extractions they need are
+    in the cache. The extractions for the next `lookahead` lines are fetched
+    concurrently in the background while the current ones are being processed.
+    """
+
+    def finish(
+        window: List[str], requests: GoogleRequests, future: "Future"
+    ) -> List[str]:
+        for (text, extractor_name, _), names in zip(requests, future.result()):
+            # left for the extractor to fetch if google couldn't be reached
+            if names is not None:
+                cache.put(text, extractor_name, names)
+        return window
+
+    from google_client import BackgroundLoop
+
+    with BackgroundLoop() as loop:
+        previous = None
+        for window in windows(lines, lookahead):
+            requests = _google_requests(window)
+            texts = [preprocessed for _, _, preprocessed in requests]
+            current = (window, requests, loop.submit(client.extract_names_many(texts)))
+            if previous:
+                yield from finish(*previous)
+            previous = current
+        if previous:
+            yield from finish(*previous)
+
+
+def use_spacy(model: str) -> None:
+    "Find names with a local spaCy model instead of Google."
+    scheduler.use(backends.local_ner_stages(STAGES, backends.SpacyBackend(model)))
+
+
+CacheSettings = Tuple[str, Optional[int], Optional[int], bool]
+
+
+def cache_settings() -> CacheSettings:
+    "What workers need to set up their cache like this process', see _init_worker."
+    memory = cache.memory
+    return cache.cache_name, memory.max_entries, memory.max_bytes, cache.keep_key_text
+
+
+def _init_worker(
+    preload: bool,
+    schedule: str,
+    schedule_stats: SchedulerStats,
+    trace_name: Optional[str],
+    spacy_model: Optional[str],
+    settings: CacheSettings,
+) -> None:
+    # spawned workers import this module afresh, so they'd have the defaults
+    cache.cache_name, max_entries, max_bytes, cache.keep_key_text = settings
+    cache.resize(max_entries, max_bytes)
+    cache.load(worker=True)
+    if spacy_model:
+        use_spacy(spacy_model)
+    scheduler.mode = schedule
+    scheduler.load()
+    scheduler.merge_stats(schedule_stats)
+    tracer.trace_name = trace_name
+    tracer.load(worker=True)
+    if preload:
+        nltk_models.preload()
+        backends.warm_up(scheduler.fixed_stages)
+
 
+def extract_chunk(lines: List[str], batch_nltk: bool = False) -> List[Entry]:
+    """
+    extract_info for each line, running each NER backend on all of them at
+    once, and NLTK too if batch_nltk.
+    """
+    extractors = backends.backend_extractors(scheduler.fixed_stages)
+    if batch_nltk or extractors:
+        texts = texts_to_extract(lines)
+        if batch_nltk:
+            nltk_extract_names_many(texts)
+        for extractor in extractors:
+            backends.extract_many(extractor, texts)
+    return [extract_info(line) for line in lines]
+
+
+def _extract_chunk_in_worker(
+    lines: List[str], batch_nltk: bool
+) -> Tuple[List[Entry], CacheEntries, CacheStats, SchedulerStats, List[Record]]:
+    entries = extract_chunk(lines, batch_nltk)
+    return (
+        entries,
+        cache.pop_new_entries(),
+        cache.pop_stats(),
+        scheduler.pop_new_stats(),
+        tracer.pop_records(),
+    )
+
+
+def extract_all(
+    lines: Iterable[str],
+    workers: int = 1,
+    chunksize: int = 8,
+    preload: bool = False,
+    batch_nltk: bool = False,
+    spacy_model: Optional[str] = None,
+) -> Iterator[Entry]:
+    """
+    Yield extract_info for each line, in order, extracting chunksize lines at
+    a time. With more than one worker, chunks are sent to a process pool, and
+    whatever each worker adds to its copy of the cache is merged back into
+    this process' cache. Only a few chunks per worker are read ahead of what
+    has been yielded. With preload, NLTK's models and the NER backends are
+    loaded before any lines are extracted, and with batch_nltk each chunk goes
+    through NLTK at once. Workers use spacy_model instead of Google if given,
+    as use_spacy should have made this process do.
+    """
+    chunks = windows(lines, chunksize)
+    if workers <= 1:
+        if preload:
+            nltk_models.preload()
+            backends.warm_up(scheduler.fixed_stages)
+        for chunk in chunks:
+            yield from extract_chunk(chunk, batch_nltk)
+        return
+    trace_name = tracer.trace_name if tracer.enabled else None
+    worker_args = (
+        preload,
+        scheduler.mode,
+        dict(scheduler.stats),
+        trace_name,
+        spacy_model,
+        cache_settings(),
+    )
+    import multiprocessing
+
+    # Pool.imap would otherwise read every line before yielding anything, so
+    # it's only handed a chunk once one of the last few it was has been yielded
+    read_ahead = threading.BoundedSemaphore(workers * 4)
+    stopped = False
+
+    def throttled_chunks() -> Iterator[List[str]]:
+        for chunk in chunks:
+            read_ahead.acquire()
+            if stopped:
+                return
+            yield chunk
+
+    extract = partial(_extract_chunk_in_worker, batch_nltk=batch_nltk)
+    with multiprocessing.Pool(workers, _init_worker, worker_args) as pool:
+        try:
+            for entries, new_entries, stats, schedule_stats, records in pool.imap(
+                extract, throttled_chunks()
+            ):
+                cache.merge(new_entries)
+                cache.merge_stats(stats)
+                scheduler.merge_stats(schedule_stats)
+                for record in records:
+                    tracer.write(record)
+                yield from entries
+                read_ahead.release()
+        finally:
+            # the pool waits for the thread feeding it when it's terminated, so
+            # that mustn't be left waiting for a chunk to be yielded
+            stopped = True
+            try:
+                read_ahead.release()
+            except ValueError:
+                pass
+
+
+def entry_func_name(stages: Stages = STAGES) -> str:
+    """
+    What entries are cached as, tagged with a version of the strategies and of
+    everything else that goes into an entry, so none are reused after changes.
+    """
+    names = [
+        [
+            strategy.__name__ + VERSION_SEPARATOR + function_version(strategy)
+            for strategy in stage
+        ]
+        for stage in stages
+    ]
+    funcs: List[Callable] = [
+        extract_info,
+        normalize_line,
+        extract_contacts,
+        could_have_phones,
+        format_phone,
+        min_max_names,
+        space_dashes,
+        search_names,
+        fuzzy_intersect,
+    ]
+    func_versions = [function_version(func) for func in funcs]
+    version = hash_key(json.dumps([scheduler.mode, names, func_versions]))[:16]
+    return "extract_info" + VERSION_SEPARATOR + version
+
+
+def extract_incrementally(
+    lines: Iterable[str], *extract_all_args: Any
+) -> Iterator[Entry]:
+    """
+    Like extract_all, but reusing the cached entries of lines that were
+    extracted with the same strategies before, and caching the rest.
+    """
+    func_name = entry_func_name(scheduler.fixed_stages)
+    cache.keep_version(func_name)
+    # every line is looked up before any are extracted, since with workers it's
+    # the pool's feeder thread that reads what extract_all is given, and the
+    # cache isn't thread safe, so only the lines themselves are kept meanwhile
+    lines = list(lines)
+    cached = [cache.contains(line, func_name) for line in lines]
+    new_lines = [line for line, is_cached in zip(lines, cached) if not is_cached]
+    extracted = extract_all(new_lines, *extract_all_args)
+    for line, is_cached in zip(lines, cached):
+        if is_cached:
+            yield Entry(**cache.get(line, func_name))
+            continue
+        entry = next(extracted)
+        cache.put(line, func_name, dict(entry))
+        yield entry
+    print("reused {} unchanged records".format(cached.count(True)))
 
-def save_entries(entries: Sequence[Entry], out_file: IO) -> None:
+
+def read_lines(in_file: IO) -> Iterator[str]:
+    "Lazily yield the first column of each row after the header."
+    rows = csv.reader(in_file)
+    next(rows, None)
+    for row in rows:
+        yield row[0]
+
+
+def write_entry(writer: Any, entry: EntryMapping) -> None:
+    # a row for each contact, written straight from the zip's tuples
+    writer.writerows(
+        zip_longest(*(entry[field] for field in Entry.FIELDS), fillvalue="")
+    )
+
+
+def save_entries(entries: Sequence[EntryMapping], out_file: IO) -> None:
     writer = csv.writer(out_file)
-    writer.writerow(entries[0].keys())
+    writer.writerow(Entry.FIELDS)
     for entry in entries:
-        contacts = zip_longest(*entry.values(), fillvalue="")
-        for contact in contacts:
-            writer.writerow(list(contact))
+        write_entry(writer, entry)
+
+
+def stream_entries(
+    entries: Iterable[EntryMapping], out_file: IO
+) -> Iterator[EntryMapping]:
+    "Write each entry to out_file as soon as it's ready, then pass it on."
+    writer = csv.writer(out_file)
+    for index, entry in enumerate(entries):
+        if not index:
+            writer.writerow(Entry.FIELDS)
+        write_entry(writer, entry)
+        out_file.flush()
+        yield entry
 
 
 class EntryType(str, Enum):
@@ -150,7 +675,7 @@ class EntryType(str, Enum):
         return self.value
 
 
-def decide_entry_type(entry: Entry) -> Sequence[EntryType]:
+def decide_entry_type(entry: EntryMapping) -> Sequence[EntryType]:
     min_names, max_names = min_max_names(entry["emails"], entry["phones"])
     if not max_names:
         return tuple()
@@ -159,33 +684,308 @@ def decide_entry_type(entry: Entry) -> Sequence[EntryType]:
     return (EntryType.all, EntryType.incorrect)
 
 
-def analyze_metrics(entries: List[Entry]) -> Tuple[Mapping, Mapping]:
-    typed_entries = [(decide_entry_type(entry), entry) for entry in entries]
-    entries_by_type = {
-        entry_type_being_found: [
-            entry
-            for entry_types, entry in typed_entries
-            if entry_type_being_found in entry_types
-        ]
-        for entry_type_being_found in EntryType
+EntryTypeColumns = Mapping[EntryType, "np.ndarray"]
+
+
+def entry_type_columns(entries: Sequence[EntryMapping]) -> EntryTypeColumns:
+    """
+    decide_entry_type for every entry at once, as a boolean column for each
+    EntryType of whether each entry is of it.
+    """
+    import numpy as np
+
+    def lengths(field: str) -> np.ndarray:
+        return np.fromiter(
+            (len(entry[field]) for entry in entries), dtype=np.intp, count=len(entries)
+        )
+
+    emails, phones, names = map(lengths, ("emails", "phones", "names"))
+    # min_max_names, a column at a time
+    min_names = np.maximum(1, np.minimum(emails, phones))
+    max_names = np.maximum(emails, phones)
+    has_contacts = max_names > 0
+    correct = has_contacts & (min_names <= names) & (names <= max_names)
+    return {
+        EntryType.correct: correct,
+        EntryType.incorrect: has_contacts & ~correct,
+        EntryType.all: has_contacts,
+    }
+
+
+def analyze_metrics(entries: Sequence[EntryMapping]) -> Tuple[Mapping, Mapping]:
+    "Returns the indices of the entries of each EntryType, and how many there are."
+    import numpy as np
+
+    indices_by_type = {
+        entry_type: np.flatnonzero(column)
+        for entry_type, column in entry_type_columns(entries).items()
+    }
+    counts = {
+        entry_type: len(indices) for entry_type, indices in indices_by_type.items()
     }
-    counts = dict(zip(entries_by_type.keys(), map(len, entries_by_type.values())))
+    print_metrics(counts)
+    return (indices_by_type, counts)
+
+
+def strategy_metrics(
+    columns: EntryTypeColumns, paths: Sequence[Sequence[str]]
+) -> Dict[str, Dict[EntryType, int]]:
+    """
+    How many entries of each EntryType each strategy was on the path of, given
+    the path that found each entry's names, e.g. from a trace.
+    """
+    import numpy as np
+
+    strategies = sorted({strategy for path in paths for strategy in path})
+    numbers = {strategy: number for number, strategy in enumerate(strategies)}
+    unique_paths = [dict.fromkeys(path) for path in paths]
+    # one (entry, strategy) pair for each strategy on each entry's path
+    rows = np.fromiter(
+        (row for row, path in enumerate(unique_paths) for _ in path), dtype=np.intp
+    )
+    strategy_numbers = np.fromiter(
+        (numbers[strategy] for path in unique_paths for strategy in path),
+        dtype=np.intp,
+    )
+    counts_by_type = {
+        entry_type: np.bincount(
+            strategy_numbers[column[rows]], minlength=len(strategies)
+        )
+        for entry_type, column in columns.items()
+    }
+    return {
+        strategy: {
+            entry_type: int(counts[number])
+            for entry_type, counts in counts_by_type.items()
+        }
+        for number, strategy in enumerate(strategies)
+    }
+
+
+def print_strategy_metrics(entries: Sequence[EntryMapping], trace_name: str) -> None:
+    "strategy_metrics of entries, with the paths traced for their lines."
+    with open(trace_name, encoding="utf-8") as trace_file:
+        paths = {record["line"]: record["path"] for record in read_trace(trace_file)}
+    breakdown = strategy_metrics(
+        entry_type_columns(entries),
+        [paths.get(entry["line"][0], []) for entry in entries],
+    )
+    print(format_table("strategy", breakdown, list(EntryType)))
+
+
+def count_entry_types(entries: Iterable[EntryMapping]) -> Mapping[EntryType, int]:
+    "Like analyze_metrics' counts, but without keeping the entries around."
+    counts = dict.fromkeys(EntryType, 0)
+    for entry in entries:
+        for entry_type in decide_entry_type(entry):
+            counts[entry_type] += 1
+    return counts
+
+
+def print_metrics(counts: Mapping[EntryType, int]) -> None:
     for entry_type in list(EntryType):
         fraction = counts[entry_type] / counts[EntryType.all]
         print("{}: {:.2%}. ".format(entry_type, fraction), end="")
     print()
-    return (entries_by_type, counts)
 
 
-def main() -> Tuple[Mapping, Mapping]:
-    with open("data/trello.csv", encoding="utf-8") as in_file:
-        lines = list(csv.reader(in_file))[1:]
-    with cache:
-        entries = [extract_info(line[0]) for line in lines]
+def main(
+    workers: int = 1,
+    prefetch: int = 0,
+    google_concurrency: int = 8,
+    stream: bool = False,
+    preload: bool = False,
+    chunksize: int = 8,
+    batch_nltk: bool = False,
+    schedule: str = "fixed",
+    trace: Optional[str] = None,
+    google_batch: int = 1,
+    incremental: bool = False,
+    spacy_model: Optional[str] = None,
+    strategy_breakdown: bool = False,
+) -> Tuple[Mapping, Mapping]:
+    """
+    When streaming, records are read, extracted, written and counted one at a
+    time, and no entries are kept, so the first mapping returned is empty.
+    With a trace name, each record's stages are traced to it as JSON lines.
+    When incremental, only records that are new or changed since a run with
+    the same strategies are extracted. With a spaCy model, it finds names
+    instead of Google, so nothing needs the network. With a strategy breakdown,
+    how many entries of each type each strategy was on the path of is printed
+    too, from the trace, for the entries extracted on this run.
+    """
+    scheduler.mode = schedule
+    tracer.trace_name = trace
+    if spacy_model:
+        use_spacy(spacy_model)
+    with open(
+        "data/trello.csv", encoding="utf-8"
+    ) as in_file, cache, scheduler, tracer, contextlib.ExitStack() as resources:
+        resources.enter_context(backends.closing(scheduler.fixed_stages))
+        raw_lines: Iterable[str] = read_lines(in_file)
+        if prefetch:
+            from google_client import LanguageClient
+
+            client = resources.enter_context(
+                LanguageClient(concurrency=google_concurrency, batch_size=google_batch)
+            )
+            raw_lines = with_google_prefetch(raw_lines, client, prefetch)
+        extract = extract_incrementally if incremental else extract_all
+        entries = extract(
+            raw_lines, workers, chunksize, preload, batch_nltk, spacy_model
+        )
+        if stream:
+            with open("data/info.csv", "w", encoding="utf-8") as out_file:
+                counts = count_entry_types(stream_entries(entries, out_file))
+            print_metrics(counts)
+            return ({}, counts)
+        entry_list = list(entries)
     with open("data/info.csv", "w", encoding="utf-8") as out_file:
-        save_entries(entries, out_file)
-    return analyze_metrics(entries)
+        save_entries(entry_list, out_file)
+    metrics = analyze_metrics(entry_list)
+    if strategy_breakdown and trace is not None:
+        print_strategy_metrics(entry_list, trace)
+    return metrics
+
+
+def parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Extract names and contact information from data/trello.csv"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="number of processes to extract records with (default: 1)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        metavar="N",
+        help="fetch google extractions for the next N records in the background",
+    )
+    parser.add_argument(
+        "--google-concurrency",
+        type=int,
+        default=8,
+        metavar="N",
+        help="google requests to keep in flight when prefetching (default: 8)",
+    )
+    parser.add_argument(
+        "--google-batch",
+        type=int,
+        default=1,
+        metavar="N",
+        help="when prefetching, send up to N texts to google in each request "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write and count each record as soon as it is extracted",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse what earlier runs with the same strategies extracted",
+    )
+    parser.add_argument(
+        "--preload-models",
+        action="store_true",
+        help="load NLTK's models in each worker before extracting anything",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=8,
+        metavar="N",
+        help="records to extract (and send to a worker) at a time (default: 8)",
+    )
+    parser.add_argument(
+        "--batch-nltk",
+        action="store_true",
+        help="run NLTK on each chunk of records at once",
+    )
+    parser.add_argument(
+        "--cache",
+        default=cache.cache_name,
+        metavar="PATH",
+        help="where results are cached, a .snapshot is shared read-only between "
+        "processes and only new results are written (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-entries",
+        type=int,
+        default=cache.memory.max_entries,
+        metavar="N",
+        help="cache results in memory for at most N calls (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-bytes",
+        type=int,
+        default=cache.memory.max_bytes,
+        metavar="N",
+        help="cache at most about N bytes of results in memory (default: no limit)",
+    )
+    parser.add_argument(
+        "--cache-key-text",
+        action="store_true",
+        help="also cache the text each result is for, which cache keys only hash",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=MODES,
+        default="fixed",
+        help="try strategies in the order they're listed in, or cheapest expected "
+        "cost per accepted answer first based on earlier runs (default: fixed)",
+    )
+    parser.add_argument(
+        "--spacy-model",
+        metavar="MODEL",
+        help="find names with this installed spaCy model, e.g. xx_ent_wiki_sm, "
+        "instead of Google, which runs offline and in batches",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="write how long each stage of each record took to PATH as JSON lines",
+    )
+    parser.add_argument(
+        "--strategy-metrics",
+        action="store_true",
+        help="print how many entries of each type each strategy found the names "
+        "of, which needs --trace",
+    )
+    args = parser.parse_args(argv)
+    if args.prefetch and args.workers > 1:
+        # workers have their own caches, so they wouldn't see what's prefetched
+        parser.error("--prefetch can't be combined with --workers")
+    if args.prefetch and args.spacy_model:
+        parser.error("--prefetch fetches from Google, which --spacy-model replaces")
+    if args.strategy_metrics and (not args.trace or args.stream):
+        parser.error("--strategy-metrics needs --trace, and doesn't work with --stream")
+    return args
 
 
 if __name__ == "__main__":
-    metrics = main()
+    args = parse_args(sys.argv[1:])
+    cache.cache_name = args.cache
+    cache.resize(args.cache_entries, args.cache_bytes)
+    cache.keep_key_text = args.cache_key_text
+    metrics = main(
+        args.workers,
+        args.prefetch,
+        args.google_concurrency,
+        args.stream,
+        args.preload_models,
+        args.chunksize,
+        args.batch_nltk,
+        args.schedule,
+        args.trace,
+        args.google_batch,
+        args.incremental,
+        args.spacy_model,
+        args.strategy_metrics,
+    )
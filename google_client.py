@@ -0,0 +1,330 @@
+"""
+Concurrent client for Google Cloud Natural Language's analyzeEntities.
+
+Keeps a bounded number of requests in flight over reused connections,
+stays under a token-bucket rate limit and retries throttled or failed
+requests with exponential backoff. The endpoint is configurable so that
+tests can point it at a local fake server.
+
+Optionally, many short texts are sent as one document, separated by blank
+lines, and the PERSON entities are split back up between them by where their
+mentions are. Offsets are in code points since UTF32 encoding is requested,
+so they index the document as a Python string.
+"""
+
+import asyncio
+import json
+import random
+import string
+import threading
+import time
+import http.client
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Coroutine, Dict, Iterator, List, Mapping, Optional, TypeVar
+from typing import Sequence, Tuple
+from urllib.parse import urlsplit
+
+X = TypeVar("X")
+Names = List[str]
+# None when the API was still throttled or failing after every retry, so that
+# it's asked again later rather than no names being cached
+MaybeNames = Optional[Names]
+Response = Mapping[str, Any]
+
+ENDPOINT = "https://language.googleapis.com/v1/documents:analyzeEntities"
+SCOPES = ["https://www.googleapis.com/auth/cloud-language"]
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BATCH_SEPARATOR = "\n\n"
+
+
+class LanguageApiError(Exception):
+    def __init__(self, status: int, reason: str):
+        super().__init__("{} {}".format(status, reason))
+        self.status = status
+
+
+def printable(raw_text: str) -> str:
+    return "".join(filter(string.printable.__contains__, raw_text))
+
+
+def request_body(raw_text: str) -> Dict[str, Any]:
+    text = printable(raw_text)
+    return {
+        "document": {"type": "PLAIN_TEXT", "content": text},
+        "encoding_type": "UTF32",
+    }
+
+
+def person_names(response: Response) -> Names:
+    return [
+        entity["name"] for entity in response["entities"] if entity["type"] == "PERSON"
+    ]
+
+
+def batches(
+    texts: Sequence[str], batch_size: int, batch_chars: int
+) -> Iterator[List[int]]:
+    """
+    Yield the indexes of up to batch_size texts at a time, with up to about
+    batch_chars characters between them. Empty texts aren't in any batch.
+    """
+    batch: List[int] = []
+    chars = 0
+    for index, text in enumerate(texts):
+        if not text:
+            continue
+        if batch and (len(batch) >= batch_size or chars + len(text) > batch_chars):
+            yield batch
+            batch, chars = [], 0
+        batch.append(index)
+        chars += len(text) + len(BATCH_SEPARATOR)
+    if batch:
+        yield batch
+
+
+def batch_document(texts: Sequence[str]) -> Tuple[str, List[int]]:
+    "Join texts into one document, returning it and where each text starts."
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + len(BATCH_SEPARATOR)
+    return BATCH_SEPARATOR.join(texts), starts
+
+
+def demultiplex(
+    response: Response, texts: Sequence[str], starts: Sequence[int]
+) -> List[Names]:
+    """
+    person_names for each of the texts that were sent as a batch_document, in
+    the order of the response's entities, i.e. by salience, like person_names.
+
+    An entity whose mentions are all in one text is named like it would have
+    been on its own. Google may also resolve mentions in different texts to one
+    entity, which then gets its first proper mention in each text as its name.
+    """
+    found: List[Names] = [[] for _ in texts]
+    for entity in response["entities"]:
+        if entity["type"] != "PERSON":
+            continue
+        mentions: Dict[int, List[Mapping[str, Any]]] = {}
+        for mention in entity.get("mentions", []):
+            offset = mention["text"].get("beginOffset", -1)
+            index = bisect_right(starts, offset) - 1
+            if index >= 0 and offset < starts[index] + len(texts[index]):
+                mentions.setdefault(index, []).append(mention)
+        for index, text_mentions in mentions.items():
+            if len(mentions) == 1:
+                name = entity["name"]
+            else:
+                proper = [m for m in text_mentions if m.get("type") == "PROPER"]
+                name = (proper or text_mentions)[0]["text"]["content"]
+            found[index].append(name)
+    return found
+
+
+class TokenBucket:
+    "Allow `rate` acquisitions per second on average, and bursts of `capacity`."
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+
+class LanguageClient:
+    """
+    One client for a whole run. Requests are made from a thread pool, each
+    thread keeping its connection open, and at most `concurrency` of them are
+    in flight at once.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = ENDPOINT,
+        concurrency: int = 8,
+        requests_per_second: float = 10.0,
+        burst: Optional[float] = None,
+        retries: int = 4,
+        backoff: float = 0.5,
+        timeout: float = 30.0,
+        credentials: Any = None,
+        batch_size: int = 1,
+        batch_chars: int = 10000,
+    ):
+        self.endpoint = urlsplit(endpoint)
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.burst = burst or float(concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # texts per request in extract_names_many, 1 to send them one by one
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        # the real API needs application default credentials, a fake doesn't
+        self.credentials = credentials
+        self.use_default_credentials = credentials is None and endpoint == ENDPOINT
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.local = threading.local()
+        self.credentials_lock = threading.Lock()
+        # created lazily so that they belong to the running event loop
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.semaphore: asyncio.Semaphore
+        self.bucket: TokenBucket
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if self.endpoint.scheme == "https":
+                connection_class: Any = http.client.HTTPSConnection
+            else:
+                connection_class = http.client.HTTPConnection
+            connection = connection_class(self.endpoint.netloc, timeout=self.timeout)
+            self.local.connection = connection
+        return connection
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.use_default_credentials or self.credentials is not None:
+            with self.credentials_lock:
+                if self.credentials is None:
+                    import google.auth
+
+                    self.credentials, _ = google.auth.default(scopes=SCOPES)
+                if not self.credentials.valid:
+                    import google_auth_httplib2
+                    import httplib2
+
+                    self.credentials.refresh(
+                        google_auth_httplib2.Request(httplib2.Http())
+                    )
+                self.credentials.apply(headers)
+        return headers
+
+    def _post(self, body: Mapping[str, Any]) -> Response:
+        "Blocking request, run in the executor."
+        path = self.endpoint.path + (
+            "?" + self.endpoint.query if self.endpoint.query else ""
+        )
+        connection = self._connection()
+        try:
+            connection.request("POST", path, json.dumps(body), self._headers())
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # the server may have closed a kept-alive connection, start over
+            connection.close()
+            self.local.connection = None
+            raise
+        if response.status != 200:
+            raise LanguageApiError(response.status, response.reason)
+        return json.loads(data)
+
+    async def analyze_entities(self, raw_text: str) -> Response:
+        loop = asyncio.get_event_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.bucket = TokenBucket(self.requests_per_second, self.burst)
+        body = request_body(raw_text)
+        async with self.semaphore:
+            attempt = 0
+            while True:
+                await self.bucket.acquire()
+                try:
+                    return await loop.run_in_executor(self.executor, self._post, body)
+                except LanguageApiError as error:
+                    if error.status not in RETRY_STATUSES or attempt >= self.retries:
+                        raise
+                except (OSError, http.client.HTTPException):
+                    if attempt >= self.retries:
+                        raise
+                delay = self.backoff * 2**attempt
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+
+    async def extract_names(self, raw_text: str) -> MaybeNames:
+        "Like strategies.google_extract_names, other API errors give no names."
+        try:
+            return person_names(await self.analyze_entities(raw_text))
+        except LanguageApiError as error:
+            if error.status in RETRY_STATUSES:
+                return None
+            return []
+
+    async def extract_names_batch(self, raw_texts: List[str]) -> List[MaybeNames]:
+        "extract_names for each of raw_texts, from a single request."
+        texts = list(map(printable, raw_texts))
+        document, starts = batch_document(texts)
+        try:
+            response = await self.analyze_entities(document)
+        except LanguageApiError as error:
+            if error.status in RETRY_STATUSES:
+                return [None] * len(raw_texts)
+            # one text the API can't take shouldn't cost the others their names
+            return list(await asyncio.gather(*map(self.extract_names, raw_texts)))
+        return list(demultiplex(response, texts, starts))
+
+    async def extract_names_many(self, texts: List[str]) -> List[MaybeNames]:
+        if self.batch_size <= 1:
+            return list(await asyncio.gather(*map(self.extract_names, texts)))
+        printable_texts = list(map(printable, texts))
+        batched = list(batches(printable_texts, self.batch_size, self.batch_chars))
+        results = await asyncio.gather(
+            *(self.extract_names_batch([texts[i] for i in batch]) for batch in batched)
+        )
+        # texts with nothing to send would just get an error, so no names
+        names: List[MaybeNames] = [[] for _ in texts]
+        for batch, batch_names in zip(batched, results):
+            for index, text_names in zip(batch, batch_names):
+                names[index] = text_names
+        return names
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self) -> "LanguageClient":
+        return self
+
+    def __exit__(self, *exception_info: Any) -> None:
+        self.close()
+
+
+class BackgroundLoop:
+    "An event loop in a daemon thread, for overlapping requests with other work."
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine: Coroutine[Any, Any, X]) -> "Future[X]":
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self) -> "BackgroundLoop":
+        return self
+
+    def __exit__(self, *exception_info: Any) -> None:
+        self.close()
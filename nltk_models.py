@@ -0,0 +1,167 @@
+"""
+Load NLTK's models once per process instead of checking for them, and maybe
+downloading them, on every call.
+
+Resources are looked for in NLTK_DATA (data/nltk_data unless the environment
+says otherwise) before NLTK's usual places, and are only downloaded if they
+can't be found anywhere and we're not offline. Run this module to download
+everything into NLTK_DATA ahead of time, and to build AMBIGUOUS_WORDS, the
+words wordnet has more than one synset for, so that remove_synonyms can check
+words against a set instead of loading wordnet through NLTK. Delete it if
+wordnet changes.
+"""
+import os
+import sys
+from functools import lru_cache
+from typing import Any, Callable, FrozenSet, List, Mapping, NamedTuple, Sequence
+from typing import Set
+
+NLTK_DATA = os.environ.get("NLTK_DATA", "data/nltk_data")
+OFFLINE = bool(os.environ.get("NLTK_OFFLINE"))
+
+# newer versions of NLTK renamed most of these, so either name will do
+Resources = Mapping[str, Sequence[str]]
+NER_RESOURCES: Resources = {
+    "tokenizer": ("tokenizers/punkt_tab", "tokenizers/punkt"),
+    "tagger": (
+        "taggers/averaged_perceptron_tagger_eng",
+        "taggers/averaged_perceptron_tagger",
+    ),
+    "chunker": ("chunkers/maxent_ne_chunker_tab", "chunkers/maxent_ne_chunker"),
+    "words": ("corpora/words",),
+}
+WORDNET_RESOURCES: Resources = {"wordnet": ("corpora/wordnet",)}
+AMBIGUOUS_WORDS = os.path.join(NLTK_DATA, "ambiguous_words.txt")
+
+
+class NerModels(NamedTuple):
+    sent_tokenize: Callable[[str], List[str]]
+    word_tokenize: Callable[[str], List[str]]
+    tagger: Any
+    chunker: Any
+
+
+def _find(path: str) -> bool:
+    import nltk
+
+    try:
+        nltk.data.find(path)
+    except LookupError:
+        return False
+    return True
+
+
+def ensure(resources: Resources, offline: bool = OFFLINE) -> None:
+    "Make sure one of the paths for each resource can be found."
+    import nltk
+
+    if NLTK_DATA not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA)
+    for name, paths in resources.items():
+        if any(map(_find, paths)):
+            continue
+        if offline:
+            raise LookupError(
+                "NLTK {} not found in {}, tried {}".format(
+                    name, nltk.data.path, ", ".join(paths)
+                )
+            )
+        for path in paths:
+            os.makedirs(NLTK_DATA, exist_ok=True)
+            nltk.download(path.split("/")[-1], download_dir=NLTK_DATA, quiet=True)
+            if _find(path):
+                break
+        else:
+            raise LookupError("couldn't download NLTK {}".format(name))
+
+
+@lru_cache(maxsize=None)
+def ner_models() -> NerModels:
+    import nltk
+
+    ensure(NER_RESOURCES)
+    chunker_factory = getattr(nltk.chunk, "ne_chunker", None)
+    if chunker_factory:
+        chunker = chunker_factory()
+    else:
+        # what ne_chunk uses in older versions of NLTK
+        chunker = nltk.data.load(nltk.chunk._MULTICLASS_NE_CHUNKER)
+    return NerModels(
+        nltk.sent_tokenize, nltk.word_tokenize, nltk.tag.PerceptronTagger(), chunker
+    )
+
+
+@lru_cache(maxsize=None)
+def wordnet() -> Any:
+    from nltk.corpus import wordnet as wordnet_reader
+
+    ensure(WORDNET_RESOURCES)
+    wordnet_reader.ensure_loaded()
+    return wordnet_reader
+
+
+def build_ambiguous_words(reader: Any) -> FrozenSet[str]:
+    """
+    Every word that reader.synsets would return more than one synset for,
+    lowercased, like synsets does.
+
+    synsets only finds the lemmas that a word is, is an exception for, or
+    becomes by one of morphy's substitutions, so it's enough to check each
+    lemma, each exception, and each lemma with a substitution undone.
+    """
+    from nltk.corpus.reader.wordnet import POS_LIST
+
+    # what synsets looks things up in, without loading the synsets themselves
+    index = reader._lemma_pos_offset_map
+    candidates: Set[str] = set(index)
+    for pos in POS_LIST:
+        candidates.update(reader._exception_map[pos])
+        substitutions = reader.MORPHOLOGICAL_SUBSTITUTIONS[pos]
+        for lemma, offsets in index.items():
+            if pos not in offsets:
+                continue
+            for old, new in substitutions:
+                if lemma.endswith(new):
+                    candidates.add(lemma[: len(lemma) - len(new)] + old)
+    return frozenset(
+        word
+        for word in candidates
+        if sum(
+            len(index[form].get(pos, ()))
+            for pos in POS_LIST
+            for form in reader._morphy(word, pos)
+        )
+        > 1
+    )
+
+
+@lru_cache(maxsize=None)
+def ambiguous_words() -> FrozenSet[str]:
+    "Read AMBIGUOUS_WORDS, building it from wordnet first if it isn't there."
+    try:
+        with open(AMBIGUOUS_WORDS, encoding="utf-8") as f:
+            return frozenset(f.read().split())
+    except FileNotFoundError:
+        pass
+    words = build_ambiguous_words(wordnet())
+    os.makedirs(NLTK_DATA, exist_ok=True)
+    # workers may be building it at the same time
+    partial_name = "{}.{}".format(AMBIGUOUS_WORDS, os.getpid())
+    with open(partial_name, "w", encoding="utf-8") as f:
+        f.write("\n".join(sorted(words)))
+    os.replace(partial_name, AMBIGUOUS_WORDS)
+    return words
+
+
+def preload() -> None:
+    "Load everything now, e.g. in a pool worker, rather than on first use."
+    models = ner_models()
+    # the tokenizers load their models lazily, so use them once
+    models.word_tokenize(models.sent_tokenize("Preload models.")[0])
+    ambiguous_words()
+
+
+if __name__ == "__main__":
+    ensure({**NER_RESOURCES, **WORDNET_RESOURCES}, offline=False)
+    ambiguous_words()
+    print("NLTK resources are in", NLTK_DATA, file=sys.stderr)
@@ -0,0 +1,140 @@
+"""
+Order each stage's strategies by what they've cost, and how often they led to
+an accepted answer, on earlier runs.
+
+In the default "fixed" mode, strategies.STAGES is used as is. In "adaptive"
+mode, each strategy is timed, and after each record the strategies that were
+tried are credited with their time, and the ones on the path that found names
+with an accepted answer. Within each stage, strategies are then tried in
+order of expected cost per accepted answer, seconds per record over the rate
+of accepted answers, which is the order that minimises the expected cost of
+trying them one after another until one works. Strategies that haven't been
+tried yet go first, so that everything gets some statistics, and ties go to
+the cheapest declared Cost, strategies that declare none counting as the most
+expensive.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Callable, DefaultDict, Dict, List, Sequence
+from strategies import Cost, Stages, STAGES
+from tables import format_table
+
+# e.g. {"nltk_extract_names": {"records": 2, "accepted": 1, "seconds": 0.3}}
+SchedulerStats = Dict[str, DefaultDict[str, float]]
+MODES = ("fixed", "adaptive")
+
+
+def stats_table() -> DefaultDict[str, DefaultDict[str, float]]:
+    return defaultdict(lambda: defaultdict(float))
+
+
+def declared_cost(strategy: Callable) -> int:
+    "The Cost a strategy declares, or its backend's, or the highest if neither does."
+    backend_cost = getattr(getattr(strategy, "backend", None), "cost", max(Cost))
+    return getattr(strategy, "cost", backend_cost)
+
+
+def format_stats(stats: SchedulerStats) -> str:
+    columns = ("records", "accepted", "seconds")
+    return format_table("strategy", dict(sorted(stats.items())), columns, "{:>11.4g}")
+
+
+class Scheduler:
+    "Which order to try strategies in, and the statistics it's decided by."
+
+    def __init__(
+        self,
+        stats_name: str = "data/scheduler.json",
+        mode: str = "fixed",
+        stages: Stages = STAGES,
+    ):
+        self.stats_name = stats_name
+        self.mode = mode
+        self.use(stages)
+        self.stats: SchedulerStats = stats_table()
+        # what was added since the last pop_new_stats, for workers to send back
+        self.new_stats: SchedulerStats = stats_table()
+        # seconds spent in each strategy tried for the current record
+        self.pending: DefaultDict[str, float] = defaultdict(float)
+
+    def use(self, stages: Stages) -> None:
+        "Schedule these strategies instead, e.g. ones with a local NER backend."
+        self.fixed_stages = stages
+        self.timed_stages = tuple(list(map(self.timed, stage)) for stage in stages)
+
+    def __enter__(self) -> None:
+        self.load()
+
+    def load(self) -> None:
+        self.stats = stats_table()
+        self.new_stats = stats_table()
+        self.pending = defaultdict(float)
+        if self.mode == "adaptive" and os.path.exists(self.stats_name):
+            with open(self.stats_name, encoding="utf-8") as f:
+                self.merge_stats(json.load(f))
+
+    def __exit__(self, *exception_info: Any) -> None:
+        if self.mode != "adaptive":
+            return
+        with open(self.stats_name, "w", encoding="utf-8") as f:
+            json.dump(self.stats, f)
+        print(format_stats(self.stats))
+
+    def timed(self, strategy: Callable) -> Callable:
+        @wraps(strategy)
+        def timed_strategy(arg: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return strategy(arg)
+            finally:
+                self.pending[strategy.__name__] += time.perf_counter() - start
+
+        return timed_strategy
+
+    def expected_cost(self, name: str) -> float:
+        counts = self.stats.get(name)
+        if not counts or not counts["records"]:
+            return 0.0
+        # smoothed, so that a strategy isn't written off after one bad record
+        success_rate = (counts["accepted"] + 1) / (counts["records"] + 2)
+        return counts["seconds"] / counts["records"] / success_rate
+
+    def stages(self) -> Stages:
+        if self.mode == "fixed":
+            return self.fixed_stages
+        ordered: List[Sequence[Callable]] = [
+            sorted(
+                stage,
+                key=lambda strategy: (
+                    self.expected_cost(strategy.__name__),
+                    declared_cost(strategy),
+                ),
+            )
+            for stage in self.timed_stages
+        ]
+        return tuple(ordered)  # type: ignore # same shape as Stages
+
+    def record(self, path: Sequence[str], accepted: bool) -> None:
+        "Credit the strategies tried since the last record."
+        for name, seconds in self.pending.items():
+            for stats in (self.stats, self.new_stats):
+                stats[name]["records"] += 1
+                stats[name]["seconds"] += seconds
+                if accepted and name in path:
+                    stats[name]["accepted"] += 1
+        self.pending = defaultdict(float)
+
+    def pop_new_stats(self) -> SchedulerStats:
+        stats, self.new_stats = self.new_stats, stats_table()
+        return dict(stats)
+
+    def merge_stats(self, stats: SchedulerStats) -> None:
+        for name, counts in stats.items():
+            for column, count in counts.items():
+                self.stats[name][column] += count
+
+
+scheduler = Scheduler()
@@ -0,0 +1,191 @@
+"""
+Keep NLTK's models, the cache and Google's client loaded between requests, for
+jobs that would otherwise start a new extract_info process for a few records.
+
+    python -m server [--socket PATH | --port N] [--preload-models]
+                     [--spacy-model MODEL]
+
+Requests and responses are JSON, one per line, over a Unix socket or TCP on
+localhost. Send {"record": "..."} for one record or {"records": [...]} for a
+batch, optionally with an "id" that's sent back, and get back {"entry": {...}}
+or {"entries": [...]}, with how many seconds the request took, or an "error".
+Connections are handled in threads, but records are extracted one request at a
+time, since the cache, scheduler and tracer aren't thread safe.
+"""
+import os
+import sys
+import stat
+import errno
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+from functools import partial
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+import nltk_models
+import backends
+from cache import cache
+from scheduler import scheduler, MODES
+from extract_info import Entry, extract_chunk, use_spacy
+
+Address = Union[str, Tuple[str, int]]
+Extract = Callable[[List[str]], Sequence[Entry]]
+
+
+class ExtractionMixin:
+    "What both kinds of server do with each line they're sent."
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Address, extract: Extract = extract_chunk):
+        self.extract = extract
+        self.lock = threading.Lock()
+        super().__init__(address, JsonLinesHandler)  # type: ignore # a socketserver
+
+    def respond(self, request_line: bytes) -> Dict[str, Any]:
+        start = time.perf_counter()
+        response: Dict[str, Any] = {}
+        try:
+            request = json.loads(request_line)
+            if "id" in request:
+                response["id"] = request["id"]
+            records = (
+                request["records"] if "records" in request else [request["record"]]
+            )
+            if not all(isinstance(record, str) for record in records):
+                raise TypeError("records must be strings")
+        except (ValueError, KeyError, TypeError) as error:
+            response["error"] = "bad request: {!r}".format(error)
+        else:
+            try:
+                with self.lock:
+                    entries = [dict(entry) for entry in self.extract(records)]
+            # one bad record shouldn't take the server down
+            except Exception as error:  # pylint: disable=broad-except
+                response["error"] = "extraction failed: {!r}".format(error)
+            else:
+                if "records" in request:
+                    response["entries"] = entries
+                else:
+                    response["entry"] = entries[0]
+        response["seconds"] = time.perf_counter() - start
+        return response
+
+
+class JsonLinesHandler(socketserver.StreamRequestHandler):
+    server: ExtractionMixin  # type: ignore # narrower than BaseServer
+
+    def handle(self) -> None:
+        for request_line in self.rfile:
+            if not request_line.strip():
+                continue
+            response = self.server.respond(request_line)
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+            self.wfile.flush()
+
+
+class UnixExtractionServer(ExtractionMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class TcpExtractionServer(ExtractionMixin, socketserver.ThreadingTCPServer):
+    pass
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Remove a socket left behind by a server that didn't shut down cleanly, or
+    raise OSError if a server's still listening on it. Anything that isn't a
+    socket is left for binding to fail on.
+    """
+    if not os.path.exists(path) or not stat.S_ISSOCK(os.stat(path).st_mode):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.remove(path)
+            return
+    raise OSError(errno.EADDRINUSE, "a server is already listening on " + path)
+
+
+def make_server(address: Address, extract: Extract = extract_chunk) -> Any:
+    "A Unix socket server if address is a path, a TCP one if it's (host, port)."
+    if isinstance(address, str):
+        remove_stale_socket(address)
+        return UnixExtractionServer(address, extract)
+    return TcpExtractionServer(address, extract)
+
+
+def call(address: Address, request: Dict[str, Any]) -> Dict[str, Any]:
+    "Send one request to a server and return its response, e.g. from another job."
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.connect(address)
+        with connection.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Serve extract_info over JSON lines")
+    parser.add_argument(
+        "--socket",
+        default="data/extract_info.sock",
+        metavar="PATH",
+        help="Unix socket to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--port", type=int, help="listen on this port on localhost instead"
+    )
+    parser.add_argument(
+        "--preload-models",
+        action="store_true",
+        help="load NLTK's models before accepting any requests",
+    )
+    parser.add_argument(
+        "--batch-nltk",
+        action="store_true",
+        help="run NLTK on each batch of records at once",
+    )
+    parser.add_argument(
+        "--cache",
+        default=cache.cache_name,
+        metavar="PATH",
+        help="where results are cached, e.g. a .snapshot that other servers share "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--spacy-model",
+        metavar="MODEL",
+        help="find names with this installed spaCy model instead of Google",
+    )
+    parser.add_argument("--schedule", choices=MODES, default="fixed")
+    args = parser.parse_args(argv)
+    address: Address = ("127.0.0.1", args.port) if args.port else args.socket
+    cache.cache_name = args.cache
+    scheduler.mode = args.schedule
+    if args.spacy_model:
+        use_spacy(args.spacy_model)
+    with cache, scheduler, backends.closing(scheduler.fixed_stages):
+        if args.preload_models:
+            nltk_models.preload()
+            backends.warm_up(scheduler.fixed_stages)
+        extract = partial(extract_chunk, batch_nltk=args.batch_nltk)
+        with make_server(address, extract) as server:
+            print("listening on", address, file=sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if isinstance(address, str):
+                    os.remove(address)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
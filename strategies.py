@@ -1,12 +1,16 @@
 import string
+from enum import IntEnum
 from itertools import combinations, filterfalse
-from functools import reduce
-from typing import List, Callable, Sequence, Tuple, TypeVar
-from typing_extensions import Protocol, runtime_checkable
-import googleapiclient.discovery
-from googleapiclient.errors import HttpError
+from functools import reduce, lru_cache
+from typing import Any, List, Callable, Sequence, Tuple, TypeVar
+import nltk_models
 from cache import cache
 
+try:
+    from typing import Protocol, runtime_checkable
+except ImportError:  # before 3.8
+    from typing_extensions import Protocol, runtime_checkable  # type: ignore
+
 X = TypeVar("X")
 Y = TypeVar("Y")
 Z = TypeVar("Z")
@@ -18,6 +22,9 @@ class Wrapper(Protocol):
 
 
 def compose(f: Callable[[Y], Z], g: Callable[[X], Y]) -> Callable[[X], Z]:
+    # versioned by what it's made of, so that its cached results go stale when
+    # either of them changes, and pinned versions are kept
+    parts = (f, g)
     use_cache = False
     if isinstance(f, Wrapper):
         f = f.__wrapped__
@@ -32,6 +39,7 @@ def compose(f: Callable[[Y], Z], g: Callable[[X], Y]) -> Callable[[X], Z]:
     composed_function.__name__ = composed_function.__qualname__ = "_".join(
         (f.__name__, g.__name__)
     )
+    composed_function.cache_parts = parts  # type: ignore
     if use_cache:
         return cache.with_cache(composed_function)
     return composed_function
@@ -40,28 +48,42 @@ def compose(f: Callable[[Y], Z], g: Callable[[X], Y]) -> Callable[[X], Z]:
 Names = List[str]
 
 
+class Cost(IntEnum):
+    "Roughly what each call costs, for ordering strategies nothing's known about."
+
+    rules = 1
+    local_model = 2
+    remote_api = 3
+
+
+def costs(cost: Cost) -> Callable[[X], X]:
+    "Declare what a strategy costs, which the adaptive scheduler reads."
+
+    def declare(strategy: X) -> X:
+        strategy.cost = cost  # type: ignore
+        return strategy
+
+    return declare
+
+
 def contains_nonlatin(text: str) -> bool:
     return not all(map(string.printable.__contains__, text))
     # .84usec faster pcall than using a comprehension
     # read as "not all of the characters are in the ASCII set"
 
 
-@cache.with_cache
-def nltk_extract_names(text: str) -> Names:
-    "Returns names using NLTK Named Entity Recognition filtering repetition"
-    import nltk
+def person_chunks(chunked_sentance: Any) -> Names:
+    from nltk.tree import Tree  # if this is cached we don't need to import nltk
 
-    nltk.download("maxent_ne_chunker")
-    nltk.download("averaged_perceptron_tagger")
-    nltk.download("punkt")
-    nltk.download("words")
-    names = [
+    return [
         " ".join(labeled[0] for labeled in chunk)
-        for sentance in nltk.sent_tokenize(text)
-        for chunk in nltk.ne_chunk(nltk.pos_tag(nltk.word_tokenize(sentance)))
-        if isinstance(chunk, nltk.tree.Tree) and chunk.label() == "PERSON"
+        for chunk in chunked_sentance
+        if isinstance(chunk, Tree) and chunk.label() == "PERSON"
     ]
-    # remove any names that contain each other
+
+
+def remove_contained_names(names: Names) -> Names:
+    "Remove any names that contain each other."
     duplicate_names = [
         max(name1, name2, key=len)
         for name1, name2 in combinations(names, 2)
@@ -70,6 +92,51 @@ def nltk_extract_names(text: str) -> Names:
     return list(set(names) - set(duplicate_names))
 
 
+@costs(Cost.local_model)
+@cache.with_cache
+def nltk_extract_names(text: str) -> Names:
+    "Returns names using NLTK Named Entity Recognition filtering repetition"
+    models = nltk_models.ner_models()
+    names = [
+        name
+        for sentance in models.sent_tokenize(text)
+        for name in person_chunks(
+            models.chunker.parse(models.tagger.tag(models.word_tokenize(sentance)))
+        )
+    ]
+    return remove_contained_names(names)
+
+
+def nltk_extract_names_many(texts: Sequence[str]) -> List[Names]:
+    """
+    nltk_extract_names for each text, but tagging and chunking the sentances
+    of every text that isn't cached yet in one pass, and caching each result.
+    """
+    uncached_texts = list(
+        dict.fromkeys(
+            text for text in texts if not cache.contains(text, "nltk_extract_names")
+        )
+    )
+    if uncached_texts:
+        models = nltk_models.ner_models()
+        sentances_by_text = [models.sent_tokenize(text) for text in uncached_texts]
+        tagged_sentances = models.tagger.tag_sents(
+            models.word_tokenize(sentance)
+            for sentances in sentances_by_text
+            for sentance in sentances
+        )
+        chunked_sentances = iter(models.chunker.parse_sents(tagged_sentances))
+        for text, sentances in zip(uncached_texts, sentances_by_text):
+            names = [
+                name
+                for _, chunked_sentance in zip(sentances, chunked_sentances)
+                for name in person_chunks(chunked_sentance)
+            ]
+            cache.put(text, "nltk_extract_names", remove_contained_names(names))
+    return [cache.get(text, "nltk_extract_names") for text in texts]
+
+
+@costs(Cost.rules)
 def all_capitalized_extract_names(text: str) -> List[str]:
     words = ("".join(filter(str.isalpha, word)) for word in text.split())
     # McCall is a name, but ELISEVER isn't
@@ -82,25 +149,29 @@ CRUDE_EXTRACTORS: Extractors = [nltk_extract_names, all_capitalized_extract_name
 # try adding nltk_extract_names_only_alpha
 
 
-@cache.with_cache
+@lru_cache(maxsize=None)
+def language_service() -> Any:
+    # building the service is slow, so only do it once per process, and
+    # importing it is too, so not at all when google's results are cached
+    import googleapiclient.discovery
+
+    return googleapiclient.discovery.build("language", "v1")
+
+
+# pinned to what its source hashed to before its imports were moved into it, so
+# that paid for results aren't thrown away, change it when its results would be
+@cache.with_cache(version="5c672972")
 def google_extract_names(raw_text: str) -> Names:
     "Return names using Google Cloud Knowledge Graph Named Entity Recognition."
-    text = "".join(filter(string.printable.__contains__, raw_text))
+    from googleapiclient.errors import HttpError
+    from google_client import request_body, person_names
+
     try:
-        body = {
-            "document": {"type": "PLAIN_TEXT", "content": text},
-            "encoding_type": "UTF32",
-        }
-        service = googleapiclient.discovery.build("language", "v1")
-        request = service.documents().analyzeEntities(  # pylint: disable=no-member
-            body=body
-        )
-        response = request.execute()
+        documents = language_service().documents()  # pylint: disable=no-member
+        response = documents.analyzeEntities(body=request_body(raw_text)).execute()
     except HttpError:
         return []
-    return [
-        entity["name"] for entity in response["entities"] if entity["type"] == "PERSON"
-    ]
+    return person_names(response)
 
 
 @cache.with_cache
@@ -130,25 +201,36 @@ GOOGLE_PREPROCESSES: List[Callable[[str], str]] = [
 ]
 
 GOOGLE_EXTRACTORS: Extractors = [
-    compose(google_extract_names, preprocess) for preprocess in GOOGLE_PREPROCESSES
+    costs(Cost.remote_api)(compose(google_extract_names, preprocess))
+    for preprocess in GOOGLE_PREPROCESSES
 ]
 
 
+def google_prefetch_requests(text: str) -> List[Tuple[str, str]]:
+    """
+    Return (extractor name, preprocessed text) for each of GOOGLE_EXTRACTORS
+    that isn't cached for text yet, so that they can be fetched ahead of time
+    and stored with cache.put(text, extractor name, names).
+    """
+    return [
+        (extractor.__name__, preprocess(text))
+        for extractor, preprocess in zip(GOOGLE_EXTRACTORS, GOOGLE_PREPROCESSES)
+        if not cache.contains(text, extractor.__name__)
+    ]
+
+
 def remove_none(names: Names) -> Names:
     return names
 
 
 @cache.with_cache
 def remove_synonyms(names: Names) -> Names:
-    from nltk.corpus import wordnet  # if this is cached we don't need to import nltk
-    import nltk
-
-    nltk.download("wordnet")
-
+    # words with more than one wordnet synset, if this is cached we don't need it
+    ambiguous_words = nltk_models.ambiguous_words()
     return [
         name
         for name in names
-        if not any(len(wordnet.synsets(word)) > 1 for word in name.split())
+        if not any(word.lower() in ambiguous_words for word in name.split())
         # note: will have synonyms for e.g. David (various dictionary-worthy Davids)
     ]
 
@@ -163,6 +245,7 @@ def remove_short(names: Names) -> Names:
     return [name for name in names if len(name) > 2]
 
 
+# refiners only ever remove names, extract_info.search_names relies on that
 Refiners = Sequence[Callable[[Names], Names]]
 
 UNIQUE_REFINERS: Refiners = [remove_short, remove_synonyms, remove_nonlatin]
@@ -0,0 +1,20 @@
+"""
+Plain text tables of statistics, e.g. the cache's hits and misses per function,
+which are printed at the end of a run.
+"""
+from typing import Any, Mapping, Sequence
+
+
+def format_table(
+    title: str,
+    rows: Mapping[str, Mapping[Any, Any]],
+    columns: Sequence[str],
+    number_format: str = "{:>11}",
+) -> str:
+    "A row of each of rows' columns, in the order given, under a header."
+    width = max(map(len, rows), default=0)
+    lines = ["{:{}} {}".format(title, width, " ".join(map("{:>11}".format, columns)))]
+    for name, row in rows.items():
+        numbers = " ".join(number_format.format(row[column]) for column in columns)
+        lines.append("{:{}} {}".format(name, width, numbers))
+    return "\n".join(lines)
@@ -48,17 +48,21 @@ def generate_graph(
         step_symbol = stages[first_change][step_state[first_change]]
         if 0 in state:
             incremented_stage = state.index(0) - 1
-            # can't skip if there isn't a previous stage to increment
-            # nor if the previous stage has run out
-            if (
+            # if the previous stage has run out, skip to the one before that
+            while (
                 incremented_stage >= 0
-                and len(stages[incremented_stage]) > state[incremented_stage] + 1
+                and len(stages[incremented_stage]) <= state[incremented_stage] + 1
             ):
+                incremented_stage -= 1
+            # can't skip if there isn't a previous stage to increment
+            if incremented_stage >= 0:
                 skip_symbol = stages[incremented_stage][state[incremented_stage] + 1]
                 skip_state = tuple(
-                    {incremented_stage: strategy + 1, incremented_stage + 1: 0}.get(
-                        stage, strategy
-                    )
+                    strategy + 1
+                    if stage == incremented_stage
+                    else 0
+                    if stage > incremented_stage
+                    else strategy
                     for stage, strategy in enumerate(state)
                 )
                 yield (state, {step_symbol: step_state, skip_symbol: skip_state})
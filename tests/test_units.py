@@ -1,10 +1,39 @@
 # mypy: disallow_untyped_decorators=False
-from typing import Any, List, Sequence
+import asyncio
+import io
+import json
+import pickle
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+from itertools import product
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Sequence
+from typing import Tuple, cast
 import pytest
+import nltk
+from nltk.corpus.reader.wordnet import WordNetCorpusReader
+import phonenumbers
 import strategies
 import extract_info
-from cache import cache
-from test_integration import generate_graph, save_cache
+import google_client
+import nltk_models
+import cache as cache_module
+from cache import cache, Cache
+from scheduler import Scheduler
+import tracing
+import evaluate
+import server
+import backends
+from test_integration import generate_graph, walk_graph, save_cache, Logger
+from benchmarks.corpus import multilingual_records
+from benchmarks.bench_contacts import unfiltered_extract_contacts
+from benchmarks import run as benchmark
 
 number_of_limbs_owed_to_google: int
 
@@ -33,6 +62,210 @@ def test_cache() -> None:
     cache.clear_cache("machine_learning_powered_echo")
 
 
+@pytest.mark.parametrize(
+    "cache_name", ["cache.json", "cache.sqlite3", "cache.snapshot"]
+)
+def test_cache_store(tmp_path: Any, cache_name: str) -> None:
+    path = str(tmp_path / cache_name)
+    parent_cache = Cache(path, keep_key_text=True)
+    with parent_cache:
+        parent_cache.put(["foo"], "shout", ["FOO"])
+    with parent_cache:
+        assert parent_cache.get(["foo"], "shout") == ["FOO"]
+        foo = cache_module.hash_key('["foo"]')
+        # key texts are kept apart from the results
+        assert parent_cache.store.results(foo) == {"shout": ["FOO"]}
+        assert parent_cache.store.get_key_text(foo) == '["foo"]'
+        worker_cache = Cache(path)
+        worker_cache.load(worker=True)
+
+        def shout(x: str) -> str:
+            return x.upper()
+
+        # in extract_info, both are the same module level cache
+        parent_cache.with_cache(shout)
+        shout = worker_cache.with_cache(shout)
+        assert shout("bar") == "BAR"
+        assert worker_cache.contains("bar", "shout")
+        assert not parent_cache.contains("bar", "shout")
+        new_entries = worker_cache.pop_new_entries()
+        assert new_entries == {
+            cache_module.hash_key("bar"): {worker_cache.tagged("shout"): "BAR"}
+        }
+        assert not worker_cache.pop_new_entries()
+        parent_cache.merge(new_entries)
+    with parent_cache:
+        assert parent_cache.get("bar", "shout") == "BAR"
+        parent_cache.clear_cache("shout")
+        assert not parent_cache.contains("bar", "shout")
+
+
+def test_cache_eviction_and_stats(tmp_path: Any) -> None:
+    bounded_cache = Cache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    calls: List[str] = []
+
+    @bounded_cache.with_cache
+    def echo(x: str) -> str:
+        calls.append(x)
+        return x
+
+    with bounded_cache:
+        for x in ["a", "b", "a", "c", "b", "a"]:
+            echo(x)
+        # "b" was evicted from memory by "c", but is still in the store
+        assert calls == ["a", "b", "c"]
+        stats = bounded_cache.pop_stats()
+    assert stats["echo"] == {"hits": 3, "memory_hits": 1, "misses": 3, "evictions": 3}
+    assert "evictions" in cache_module.format_stats(stats)
+
+
+def test_cache_versions(tmp_path: Any) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    versioned_cache = Cache(path)
+    with versioned_cache:
+        # stored before functions had versions
+        versioned_cache.put("foo", "shout", "FOO")
+        versioned_cache.put("foo", "paid_shout", "FOO")
+
+        @versioned_cache.with_cache
+        def shout(x: str) -> str:
+            return x.upper() + "!"
+
+        # only taken to be current when the version is pinned
+        @versioned_cache.with_cache(version="1")
+        def paid_shout(x: str) -> str:
+            return x.upper() + "!"
+
+        assert shout("foo") == "FOO!"
+        assert paid_shout("foo") == "FOO"
+        assert shout("bar") == "BAR!"
+        first_version = versioned_cache.tagged("shout")
+
+    def shout(x: str) -> str:  # type: ignore # redefined on purpose
+        return x.upper() + "!!"
+
+    shout = versioned_cache.with_cache(shout)
+    assert versioned_cache.tagged("shout") != first_version
+    with versioned_cache:
+        assert shout("bar") == "BAR!!"
+        assert shout("foo") == "FOO!!"
+        # results that are put rather than wrapped, like extract_info's entries
+        versioned_cache.put("foo", "entries@0", "old")
+        versioned_cache.put("foo", "entries@1", "new")
+        versioned_cache.keep_version("entries@1")
+    store = cache_module.open_store(path)
+    func_names = {func_name for _, func_name, _ in store.entries()}
+    store.close()
+    assert func_names == {
+        versioned_cache.tagged("shout"),
+        versioned_cache.tagged("paid_shout"),
+        "entries@1",
+    }
+    # a composition's version depends on its parts'
+    composed = strategies.compose(strategies.remove_short, strategies.remove_nonlatin)
+    assert cache_module.function_version(composed) != cache_module.function_version(
+        strategies.compose(strategies.remove_short, strategies.remove_synonyms)
+    )
+
+
+def test_cache_snapshot(tmp_path: Any) -> None:
+    keys = [cache_module.hash_key(str(number)) for number in range(500)]
+    entries: List[cache_module.StoredEntry] = [
+        (key, "echo@1", [number]) for number, key in enumerate(keys)
+    ]
+    entries += [(keys[0], "echo@0", "stale"), (keys[1], "shout", "ONE")]
+    path = str(tmp_path / "cache.snapshot")
+    cache_module.write_snapshot(entries, path)
+    snapshot = cache_module.Snapshot(path)
+    assert snapshot.func_names == {"echo@0", "echo@1", "shout"}
+    assert all(snapshot.get(key, name) == value for key, name, value in entries)
+    with pytest.raises(KeyError):
+        snapshot.get(keys[1], "echo@0")
+    assert sorted(snapshot.entries()) == sorted(entries)
+    snapshot.close()
+    store = cache_module.open_store(path)
+    store.put(keys[0], "echo@1", "overlaid")
+    store.put(keys[0], "echo@2", "new")
+    store.delete(keys[1], "shout")
+    store.delete_versions("echo", keep="echo@2")
+    store.close()
+    # deletions made by the writer are seen by readers opened after them
+    reader = cache_module.open_store(path, read_only=True)
+    assert reader.get(keys[0], "echo@2") == "new"
+    for name in ["echo@0", "echo@1", "shout"]:
+        with pytest.raises(KeyError):
+            reader.get(keys[1], name)
+    reader.close()
+    store = cache_module.OverlayStore(path)
+    store.compact()
+    assert list(store.entries()) == [(keys[0], "echo@2", "new")]
+    assert not list(store.overlay.entries()) and not store.deletions
+    store.close()
+    snapshot = cache_module.Snapshot(path)
+    assert list(snapshot.entries()) == [(keys[0], "echo@2", "new")]
+    snapshot.close()
+
+
+def test_lru_tier_max_bytes() -> None:
+    tier = cache_module.LruTier(max_entries=None, max_bytes=300)
+    assert tier.put("a", "f", "x" * 100) == []
+    assert tier.put("b", "g", "y" * 100) == ["f"]
+    with pytest.raises(KeyError):
+        tier.get("a", "f")
+    assert tier.get("b", "g") == "y" * 100
+
+
+def test_cache_json_round_trip(tmp_path: Any) -> None:
+    # keys written by earlier versions are the texts themselves
+    data = {"foo": {"shout": "FOO", "echo": "foo"}, '["bar"]': {"shout": ["BAR"]}}
+    foo, bar = cache_module.hash_key("foo"), cache_module.hash_key('["bar"]')
+    json_path = str(tmp_path / "cache.json")
+    json.dump(data, open(json_path, "w"))
+    store = cache_module.open_store(str(tmp_path / "cache.sqlite3"))
+    cache_module.import_json(store, json_path)
+    assert store.get(bar, "shout") == ["BAR"]
+    store.delete(foo, "echo")
+    store.compact()
+    cache_module.export_json(store, json_path)
+    store.close()
+    assert json.load(open(json_path)) == {foo: {"shout": "FOO"}, bar: {"shout": ["BAR"]}}
+    # and importing hashed keys leaves them as they are
+    store = cache_module.open_store(str(tmp_path / "other.sqlite3"))
+    cache_module.import_json(store, json_path)
+    assert store.get(foo, "shout") == "FOO"
+    store.close()
+
+
+def test_cache_key_migration(tmp_path: Any) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE entries "
+        "(key TEXT, func_name TEXT, value TEXT, PRIMARY KEY (key, func_name))"
+    )
+    connection.execute("INSERT INTO entries VALUES (?, ?, ?)", ("foo", "shout", '"FOO"'))
+    # key texts used to be stored as results
+    connection.execute(
+        "INSERT INTO entries VALUES (?, ?, ?)", ("foo", "key_text", '"foo"')
+    )
+    connection.commit()
+    connection.close()
+    debug_cache = Cache(path, keep_key_text=True)
+    with debug_cache:
+        assert debug_cache.get("foo", "shout") == "FOO"
+        debug_cache.put(["bar"], "shout", ["BAR"])
+        assert not debug_cache.contains(["bar"], "key_text")
+    store = cache_module.open_store(path)
+    keys = [key for key, _, _ in store.entries()]
+    assert {func_name for _, func_name, _ in store.entries()} == {"shout"}
+    assert store.get_key_text(cache_module.hash_key("foo")) == "foo"
+    assert store.get_key_text(cache_module.hash_key('["bar"]')) == '["bar"]'
+    store.close()
+    assert sorted(set(keys)) == sorted(
+        map(cache_module.hash_key, ["foo", '["bar"]'])
+    )
+
+
 # strategies
 
 
@@ -42,6 +275,95 @@ def test_contains_nonlatin() -> None:
     assert strategies.contains_nonlatin(u"Лена Stephanie")
 
 
+def test_nltk_models_ensure(tmp_path: Any, monkeypatch: Any) -> None:
+    (tmp_path / "corpora" / "fake_corpus").mkdir(parents=True)
+    monkeypatch.setattr(nltk_models, "NLTK_DATA", str(tmp_path))
+    monkeypatch.setattr(nltk.data, "path", list(nltk.data.path))
+    nltk_models.ensure({"fake": ("corpora/renamed", "corpora/fake_corpus")}, True)
+    with pytest.raises(LookupError):
+        nltk_models.ensure({"missing": ("corpora/not_here",)}, offline=True)
+
+
+class FakeWordnet:
+    "Just enough of a WordNetCorpusReader for synsets to work, and be compared to."
+
+    MORPHOLOGICAL_SUBSTITUTIONS = WordNetCorpusReader.MORPHOLOGICAL_SUBSTITUTIONS
+    synsets = WordNetCorpusReader.synsets
+    _morphy = WordNetCorpusReader._morphy
+
+    def __init__(self) -> None:
+        self._lemma_pos_offset_map = {
+            "bank": {"n": [1, 2], "v": [3]},
+            "rose": {"n": [4]},
+            "rise": {"v": [5]},
+            "goose": {"n": [6]},
+            "fly": {"n": [7], "v": [8]},
+            "axe": {"n": [9]},
+            "axis": {"n": [10]},
+            "hope": {"v": [11]},
+            "hop": {"v": [12]},
+            "good": {"a": [13], "s": [13]},
+            "smith": {"n": [14]},
+        }
+        self._exception_map = {
+            "n": {"geese": ["goose"], "axes": ["axe", "axis"]},
+            "v": {"rose": ["rise"]},
+            "a": {"better": ["good"]},
+            "r": {},
+        }
+
+    def synset_from_pos_and_offset(self, pos: str, offset: int) -> Any:
+        return pos, offset
+
+
+def test_ambiguous_words(tmp_path: Any, monkeypatch: Any) -> None:
+    fake_wordnet = FakeWordnet()
+    ambiguous_words = nltk_models.build_ambiguous_words(fake_wordnet)
+    words = ["Bank", "Smith", "nobody", "geese", "better", "flies", "axes"] + [
+        lemma + suffix
+        for lemma in fake_wordnet._lemma_pos_offset_map
+        for suffix in ("", "s", "es", "d", "ed", "ing", "er", "est")
+    ]
+    for word in words:
+        assert (word.lower() in ambiguous_words) == (
+            len(fake_wordnet.synsets(word)) > 1
+        ), word
+    assert "bank" in ambiguous_words and "smith" not in ambiguous_words
+    # built once, then read back without wordnet
+    monkeypatch.setattr(nltk_models, "AMBIGUOUS_WORDS", str(tmp_path / "words.txt"))
+    monkeypatch.setattr(nltk_models, "wordnet", lambda: fake_wordnet)
+    nltk_models.ambiguous_words.cache_clear()
+    assert nltk_models.ambiguous_words() == ambiguous_words
+    nltk_models.ambiguous_words.cache_clear()
+    monkeypatch.setattr(nltk_models, "wordnet", None)
+    assert nltk_models.ambiguous_words() == ambiguous_words
+    nltk_models.ambiguous_words.cache_clear()
+
+
+@pytest.fixture(name="nltk_ner")
+def nltk_ner_fixture() -> None:
+    try:
+        nltk_models.ensure(nltk_models.NER_RESOURCES, offline=True)
+    except LookupError:
+        pytest.skip("NLTK's models aren't downloaded")
+
+
+@pytest.mark.usefixtures("save_cache", "nltk_ner")
+def test_nltk_extract_names_many() -> None:
+    texts = [
+        "Lisa Smith met Bob Miller in Boston. Call Lisa at 617.555.5555",
+        "no names here at all",
+        "Lisa Smith met Bob Miller in Boston. Call Lisa at 617.555.5555",
+    ]
+    for text in texts:
+        cache.delete(text, "nltk_extract_names")
+    actual = strategies.nltk_extract_names_many(texts)
+    uncached = cast(strategies.Wrapper, strategies.nltk_extract_names).__wrapped__
+    expected = [uncached(text) for text in texts]
+    assert actual == expected
+    assert cache.get(texts[1], "nltk_extract_names") == expected[1]
+
+
 def test_every_name() -> None:
     assert strategies.every_name(
         "3/14 Planet Fitness McCall 603-750-0001 X 119 Paid cr card"
@@ -51,6 +373,163 @@ def test_every_name() -> None:
     )
 
 
+# google_client
+
+
+class FakeLanguageApi(BaseHTTPRequestHandler):
+    """
+    Says every capitalized word is a person, mentioned wherever it is in the
+    document, and throttles the first THROTTLE. Entities are listed by name,
+    which stands in for the salience the real API lists them by.
+    """
+
+    requests: List[str] = []
+    throttled = False
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text = body["document"]["content"]
+        FakeLanguageApi.requests.append(text)
+        if "THROTTLE" in text and not FakeLanguageApi.throttled:
+            FakeLanguageApi.throttled = True
+            self.send_response(429)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        entities: Dict[str, Dict[str, Any]] = {}
+        for word in re.finditer(r"\S+", text):
+            name = word.group()
+            if name[0].isupper() and not name.isupper():
+                entity = entities.setdefault(
+                    name, {"name": name, "type": "PERSON", "mentions": []}
+                )
+                mention = {"content": name, "beginOffset": word.start()}
+                entity["mentions"].append({"text": mention, "type": "PROPER"})
+        by_name = [entities[name] for name in sorted(entities)]
+        response = json.dumps({"entities": by_name}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture(name="fake_language_client")
+def fake_language_client_fixture() -> Iterable[google_client.LanguageClient]:
+    FakeLanguageApi.requests = []
+    FakeLanguageApi.throttled = False
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLanguageApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = "http://127.0.0.1:{}/v1/documents:analyzeEntities".format(
+        server.server_port
+    )
+    client = google_client.LanguageClient(endpoint, concurrency=4, backoff=0.01)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_language_client(fake_language_client: google_client.LanguageClient) -> None:
+    texts = ["Lisa balloon drop", "THROTTLE Bob Miller", "nobody here"]
+    actual = asyncio.run(fake_language_client.extract_names_many(texts))
+    assert actual == [["Lisa"], ["Bob", "Miller"], []]
+    # the throttled request was retried
+    assert len(FakeLanguageApi.requests) == 4
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_language_client_gives_up(
+    fake_language_client: google_client.LanguageClient, batch_size: int
+) -> None:
+    fake_language_client.retries = 0
+    fake_language_client.batch_size = batch_size
+    texts = ["THROTTLE Bob Miller", "Lisa balloon drop"]
+    actual = asyncio.run(fake_language_client.extract_names_many(texts))
+    # not no names, which would be cached, but unknown
+    assert actual[0] is None
+
+
+def test_language_client_batches(
+    fake_language_client: google_client.LanguageClient,
+) -> None:
+    texts = ["Lisa balloon drop", "", "Bob Miller and Lisa", "ünïcode Zoë Bob"] * 3
+    expected = asyncio.run(fake_language_client.extract_names_many(texts))
+    FakeLanguageApi.requests = []
+    fake_language_client.batch_size = 4
+    actual = asyncio.run(fake_language_client.extract_names_many(texts))
+    assert actual == expected
+    assert expected[2] == ["Bob", "Lisa", "Miller"]
+    assert expected[3] == ["Bob", "Zo"]
+    # the empty texts aren't sent at all
+    assert len(FakeLanguageApi.requests) == 3
+
+
+def test_demultiplex() -> None:
+    texts = ["Bob Miller paid", "Bob"]
+    document, starts = google_client.batch_document(texts)
+    assert document == "Bob Miller paid\n\nBob"
+    assert starts == [0, 17]
+
+    def mention(content: str, offset: int, kind: str = "PROPER") -> Any:
+        return {"text": {"content": content, "beginOffset": offset}, "type": kind}
+
+    response = {
+        "entities": [
+            {"name": "Bob Miller", "type": "PERSON", "mentions": [mention("Bob", 17)]},
+            {
+                "name": "Bob Miller",
+                "type": "PERSON",
+                "mentions": [mention("Bob Miller", 0), mention("Bob", 17)],
+            },
+            {"name": "paid", "type": "OTHER", "mentions": [mention("paid", 11)]},
+        ]
+    }
+    names = google_client.demultiplex(response, texts, starts)
+    assert names == [["Bob Miller"], ["Bob Miller", "Bob"]]
+    assert list(google_client.batches(["ab", "", "cd", "ef"], 2, 100)) == [[0, 2], [3]]
+    assert list(google_client.batches(["ab", "cd"], 5, 3)) == [[0], [1]]
+
+
+def test_token_bucket() -> None:
+    async def acquire_all() -> None:
+        bucket = google_client.TokenBucket(rate=100, capacity=1)
+        for _ in range(4):
+            await bucket.acquire()
+
+    loop = asyncio.new_event_loop()
+    start = loop.time()
+    loop.run_until_complete(acquire_all())
+    assert loop.time() - start >= 0.03
+    loop.close()
+
+
+@pytest.mark.usefixtures("save_cache")
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_google_prefetch(
+    fake_language_client: google_client.LanguageClient, batch_size: int
+) -> None:
+    fake_language_client.batch_size = batch_size
+    lines = ["Zelda Quux 617.555.0000 x{}".format(i) for i in range(5)]
+    lines.append("no contact info here")
+    prefetched = extract_info.with_google_prefetch(lines, fake_language_client, 2)
+    assert list(prefetched) == lines
+    texts = [extract_info.space_dashes(line) for line in lines[:-1]]
+    if batch_size == 1:
+        # one request for each of the GOOGLE_PREPROCESSES for each record
+        assert len(FakeLanguageApi.requests) == 3 * len(texts)
+    else:
+        # one request for each window of 2 lines
+        assert len(FakeLanguageApi.requests) == 3
+    for text in texts:
+        names = cache.get(text, "google_extract_names_no_preprocess")
+        assert names == ["Quux", "Zelda"]
+        for extractor in strategies.GOOGLE_EXTRACTORS:
+            cache.delete(text, extractor.__name__)
+
+
 # extract_info
 
 
@@ -70,6 +549,407 @@ def test_fuzzy_intersect() -> None:
         assert extract_info.fuzzy_intersect(left, right) == expected
 
 
+def ordered_set(names: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(names))
+
+
+def recursive_fuzzy_intersect(
+    left: List[str], right: List[str], recursive: bool = False
+) -> List[str]:
+    """
+    The original recursive fuzzy_intersect, except that its sets made the order
+    of the result (and which of several longest names won) depend on string
+    hashing, so this keeps them in list order instead.
+    """
+    if recursive:
+        if not left:
+            return []
+    else:
+        if not (left and right):
+            return left or right
+    first_left, *remaining_left = left
+    similar_right = ordered_set(
+        right_name
+        for right_name in right
+        if right_name in first_left or first_left in right_name
+    )
+    if similar_right:
+        also_similar_left = ordered_set(
+            left_name
+            for left_name in remaining_left
+            if left_name in first_left or first_left in left_name
+        )
+        intersection = max(first_left, *similar_right, *also_similar_left, key=len)
+        dissimilar_right = [name for name in right if name not in similar_right]
+        dissimilar_left = [
+            name for name in ordered_set(remaining_left) if name not in also_similar_left
+        ]
+        return [intersection] + recursive_fuzzy_intersect(
+            dissimilar_left, dissimilar_right, True
+        )
+    return recursive_fuzzy_intersect(remaining_left, right, recursive=True)
+
+
+def random_names(rng: random.Random, count: int) -> List[str]:
+    words = ["Bo", "Bob", "Ann", "Anna", "Miller", "Mill", "Kochi", "Ko", "TO", ""]
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(1, 2))).strip()
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("min_indexed_names", [0, 128])
+def test_fuzzy_intersect_matches_recursive(
+    min_indexed_names: int, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr(extract_info.NameIndex, "min_indexed_names", min_indexed_names)
+    rng = random.Random(min_indexed_names)
+    for _ in range(500):
+        left = random_names(rng, rng.randint(0, 30))
+        right = random_names(rng, rng.randint(0, 30))
+        expected = recursive_fuzzy_intersect(left, right)
+        assert extract_info.fuzzy_intersect(left, right) == expected
+
+
+def test_fuzzy_intersect_long_lists() -> None:
+    # the recursive version ran out of stack around here
+    left = ["Name{:04}".format(i) for i in range(5000)]
+    right = list(reversed(left))
+    assert extract_info.fuzzy_intersect(left, right) == left
+
+
+# stub strategies, named for what they stand in for
+def no_google(text: str) -> List[str]:
+    return []
+
+
+def google(text: str) -> List[str]:
+    return ["Bob Miller", "Lisa Smith"]
+
+
+def first_names(text: str) -> List[str]:
+    return ["Bob", "Lisa"]
+
+
+def keep(names: List[str]) -> List[str]:
+    return names
+
+
+def only_bob(names: List[str]) -> List[str]:
+    return [name for name in names if "Bob" in name]
+
+
+def test_search_names() -> None:
+    def same_google(text: str) -> List[str]:
+        return ["Bob Miller", "Lisa Smith"]
+
+    def nobody(text: str) -> List[str]:
+        return ["Zed"]
+
+    def walk_trace(stages: List[List[Any]]) -> None:
+        names = [[""] + [strategy.__name__ for strategy in stage] for stage in stages]
+        trace = logger.stream.getvalue().split()
+        walk_graph(trace, (0, 0, 0), dict(generate_graph(names)))
+
+    logger = Logger()
+    unlogged: List[List[Callable]] = [
+        [no_google, google, same_google],
+        [first_names, nobody],
+        [keep],
+    ]
+    stages: Any = [
+        [logger.logged(strategy) for strategy in stage] for stage in unlogged
+    ]
+    result = extract_info.search_names("", 1, 1, stages)
+    # same_google's extraction, and consensuses without enough names, aren't refined
+    assert logger.stream.getvalue().split() == [
+        "no_google",
+        "google",
+        "first_names",
+        "keep",
+        "nobody",
+        "same_google",
+        "first_names",
+        "nobody",
+    ]
+    assert result == ([], 8, ())
+    walk_trace(stages)
+
+    logger.new_stream()
+    stages[2].append(logger.logged(only_bob))
+    result = extract_info.search_names("", 1, 1, stages)
+    assert result == (["Bob Miller"], 5, ("google", "first_names", "only_bob"))
+    walk_trace(stages)
+
+
+def test_evaluate() -> None:
+    stages: Any = ([no_google, google], [first_names], [keep, only_bob])
+    lines = [
+        "Bob Miller and Lisa Smith bob@example.com lisa@example.com",
+        "Bob Miller 617-555-0100",
+        "no contacts",
+    ]
+    paths = evaluate.path_labels(stages)
+    assert paths[-1] == evaluate.SEARCH and len(paths) == 5
+    for line in lines:
+        entries = evaluate.evaluate_line(line, stages)
+        # each path gives what extract_info would with just that path's strategies
+        for path, entry in zip(product(*stages), entries):
+            single_path = tuple([strategy] for strategy in path)
+            assert entry == extract_info.extract_info(line, stages=single_path)
+        assert entries[-1] == extract_info.extract_info(line, stages=stages)
+    examples = [evaluate.evaluate_line(lines[0], stages)[2]]
+    counterexamples = [evaluate.evaluate_line(lines[1], stages)[1]]
+    evaluation = evaluate.evaluate(examples, counterexamples, stages)
+    assert list(evaluation.correct) == [0, 0, 1, 0, 1]
+    assert list(evaluation.incorrect) == [0, 1, 0, 0, 0]
+    assert evaluation.format().splitlines()[2].startswith("google > first_names > keep")
+    assert evaluation.as_dict()["paths"]["search"] == {"correct": 1, "incorrect": 0}
+
+
+def test_scheduler(tmp_path: Any) -> None:
+    def slow(text: str) -> List[str]:
+        return ["Bob Miller"]
+
+    def cheap(text: str) -> List[str]:
+        return ["Bob Miller"]
+
+    def bob(text: str) -> List[str]:
+        return ["Bob"]
+
+    stages: Any = ([slow, cheap], [bob], [keep])
+    fixed = Scheduler(str(tmp_path / "scheduler.json"), "fixed", stages)
+    assert fixed.stages() is stages
+
+    scheduler = Scheduler(str(tmp_path / "scheduler.json"), "adaptive", stages)
+    with scheduler:
+        # nothing's been tried yet, so the order is as listed
+        assert [s.__name__ for s in scheduler.stages()[0]] == ["slow", "cheap"]
+        scheduler.stats["slow"].update(records=4, accepted=3, seconds=4.0)
+        scheduler.stats["cheap"].update(records=4, accepted=1, seconds=0.4)
+        assert [s.__name__ for s in scheduler.stages()[0]] == ["cheap", "slow"]
+        result = extract_info.search_names("", 1, 1, scheduler.stages())
+        assert result.path == ("cheap", "bob", "keep")
+        scheduler.record(result.path, True)
+        assert scheduler.stats["cheap"]["records"] == 5
+        assert scheduler.stats["cheap"]["accepted"] == 2
+        assert scheduler.stats["slow"]["records"] == 4
+        assert scheduler.pop_new_stats()["cheap"]["records"] == 1
+
+    # the statistics are there on the next run
+    scheduler = Scheduler(str(tmp_path / "scheduler.json"), "adaptive", stages)
+    with scheduler:
+        assert scheduler.stats["cheap"]["accepted"] == 2
+        assert [s.__name__ for s in scheduler.stages()[0]] == ["cheap", "slow"]
+
+
+class FakeBackend:
+    "Capitalized words as one name, counting each batch it's sent."
+
+    name = "fake_extract_names"
+    version = "0000beef"
+    cost = backends.Cost.local_model
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self.batches: List[List[str]] = []
+
+    def load(self) -> None:
+        self.loaded = True
+
+    def warm_up(self) -> None:
+        self.load()
+
+    def extract_many(self, texts: Sequence[str]) -> List[List[str]]:
+        self.load()
+        self.batches.append(list(texts))
+        return [
+            [" ".join(word for word in text.split() if word.istitle())]
+            for text in texts
+        ]
+
+    def close(self) -> None:
+        self.loaded = False
+
+
+@pytest.mark.usefixtures("save_cache")
+def test_backends(tmp_path: Any) -> None:
+    backend = FakeBackend()
+    extractor = backends.as_extractor(backend)
+    cache.clear_cache(backend.name)
+    assert cache.tagged(backend.name) == "fake_extract_names@0000beef"
+    assert extractor("Call Ann now") == ["Call Ann"]
+    texts = ["Call Ann now", "Bob", "Bob", "and Cy"]
+    assert backends.extract_many(extractor, texts) == [
+        ["Call Ann"],
+        ["Bob"],
+        ["Bob"],
+        ["Cy"],
+    ]
+    # only what wasn't cached, once each, and in one batch
+    assert backend.batches == [["Call Ann now"], ["Bob", "and Cy"]]
+
+    stages: Any = ([extractor], [extractor], [keep])
+    assert backends.backends(stages) == [backend]
+    # untried strategies go cheapest first, and ones that declare no cost are
+    # taken to be as expensive as any
+    adaptive = Scheduler(str(tmp_path / "scheduler.json"), "adaptive", stages)
+    google_extractor = strategies.GOOGLE_EXTRACTORS[0]
+    stage: Any = [
+        keep,
+        google_extractor,
+        extractor,
+        strategies.all_capitalized_extract_names,
+    ]
+    adaptive.use((stage, [], []))
+    assert [s.__name__ for s in adaptive.stages()[0]] == [
+        "all_capitalized_extract_names",
+        "fake_extract_names",
+        "keep",
+        google_extractor.__name__,
+    ]
+    lines = ["Dee Fox dee@fox.com", "Eve Lee eve@lee.com"]
+    extract_info.scheduler.use(stages)
+    try:
+        with backends.closing(stages):
+            entries = extract_info.extract_chunk(lines)
+            assert backend.loaded
+    finally:
+        extract_info.scheduler.use(strategies.STAGES)
+    assert not backend.loaded
+    assert [entry["names"] for entry in entries] == [["Dee Fox"], ["Eve Lee"]]
+    assert backend.batches[2:] == [["Dee Fox dee@fox.com", "Eve Lee eve@lee.com"]]
+    cache.clear_cache(backend.name)
+
+
+def test_spacy_backend() -> None:
+    spacy_backend = backends.SpacyBackend("xx_ent_wiki_sm")
+    assert spacy_backend.name == "spacy_extract_names_xx_ent_wiki_sm"
+    assert len(spacy_backend.version) == cache_module.VERSION_LENGTH
+    people = [SimpleNamespace(text=name, label_="PER") for name in ["Ann", "Ann Lee"]]
+    place = SimpleNamespace(text="Boston", label_="LOC")
+    # what spacy.load returns, as far as the backend is concerned
+    spacy_backend.nlp = SimpleNamespace(
+        pipe=lambda texts, batch_size: [SimpleNamespace(ents=people + [place])]
+        * len(texts)
+    )
+    assert spacy_backend.extract_many(["Ann Lee, Boston"]) == [["Ann"]]
+    spacy_backend.close()
+    assert spacy_backend.nlp is None
+
+
+def test_min_phone_digits() -> None:
+    for country_code, regions in phonenumbers.COUNTRY_CODE_TO_REGION_CODE.items():
+        for region in regions:
+            if region == "001":
+                metadata = phonenumbers.PhoneMetadata.metadata_for_nongeo_region(
+                    country_code
+                )
+            else:
+                metadata = phonenumbers.PhoneMetadata.metadata_for_region(region)
+            if metadata is None or metadata.general_desc is None:
+                continue
+            lengths = filter(None, metadata.general_desc.possible_length)
+            shortest = len(str(country_code)) + min(lengths)
+            assert shortest >= extract_info.MIN_PHONE_DIGITS, region
+
+
+def test_extract_contacts() -> None:
+    rng = random.Random(0)
+    examples = [
+        phonenumbers.format_number(number, number_format)
+        for region in sorted(phonenumbers.SUPPORTED_REGIONS)
+        for number in [phonenumbers.example_number(region)]
+        if number
+        for number_format in (
+            phonenumbers.PhoneNumberFormat.E164,
+            phonenumbers.PhoneNumberFormat.NATIONAL,
+        )
+    ]
+    lines = multilingual_records(200) + [
+        "{}{}{}".format(
+            rng.choice(["", "Bob ", "12/3 -- "]),
+            # dropping characters makes some of them too short to be valid
+            "".join(char for char in example if rng.random() > 0.1),
+            rng.choice(["", " ext 12", " b@c.d"]),
+        )
+        for example in examples
+    ]
+    assert not extract_info.could_have_phones("12/31 -- X 119 -- $200")
+    for line in lines:
+        assert extract_info.extract_contacts(line) == unfiltered_extract_contacts(line)
+
+
+def test_benchmark_run() -> None:
+    results = benchmark.run(20, seed=1, max_phones=1)
+    assert results["corpus"] == {"records": 20, "seed": 1, "max_phones": 1}
+    stages = results["stages"]
+    for stage in ["extract_contacts", "fuzzy_intersect", "remove_none"]:
+        assert stages[stage]["calls"] > 0
+    assert stages["save_entries"]["calls"] == stages["analyze_metrics"]["calls"] == 1
+    assert "fake_google_extract_names_only_alpha" in stages
+    assert "strategies" in results["startup"]["imports"]
+    json.dumps(results)
+
+
+def test_lazy_imports() -> None:
+    # a run that's all cache hits shouldn't pay for importing these
+    imported = subprocess.run(
+        [sys.executable, "-c", "import extract_info, sys; print(*sys.modules)"],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    for module in ["numpy", "phonenumbers", "googleapiclient", "nltk"]:
+        assert module not in imported
+
+
+def test_tracer(tmp_path: Any) -> None:
+    assert tracing.tracer.stage("disabled") is tracing.NULL_CONTEXT
+    cache.clear_cache("traced_bob")
+
+    @cache.with_cache
+    def traced_bob(text: str) -> List[str]:
+        return ["Bob"]
+
+    stages: Any = ([google], [traced_bob], [keep])
+    trace_name = str(tmp_path / "trace.jsonl")
+    tracing.tracer.trace_name = trace_name
+    with tracing.tracer:
+        for line in ["Bob Miller 617-555-1234", "Bob Miller 617-555-1234", "no one"]:
+            extract_info.extract_info(line, stages=stages)
+    tracing.tracer.trace_name = None
+    assert tracing.tracer.stage("disabled") is tracing.NULL_CONTEXT
+    with open(trace_name, encoding="utf-8") as trace_file:
+        records = list(tracing.read_trace(trace_file))
+    assert [record["path"] for record in records] == [
+        ["google", "traced_bob", "keep"],
+        ["google", "traced_bob", "keep"],
+        [],
+    ]
+    assert [event["stage"] for event in records[0]["stages"]] == [
+        "extract_contacts",
+        "space_dashes",
+        "google",
+        "traced_bob",
+        "fuzzy_intersect",
+        "keep",
+    ]
+    cache_lookups = [
+        (event["hits"], event["misses"])
+        for record in records[:2]
+        for event in record["stages"]
+        if event["stage"] == "traced_bob"
+    ]
+    assert cache_lookups == [(0, 1), (1, 0)]
+    summary = tracing.summarize(records)
+    assert summary.records == 3
+    assert summary.stages["keep"]["calls"] == 2
+    assert summary.paths["google > traced_bob > keep"]["evaluations"] == 6
+    assert summary.paths["(none)"]["records"] == 1
+    assert "traced_bob" in summary.format()
+
+
 LINE = "12/31 -- Lisa balloon drop -- off 617.555.5555 - paid, check deposited"
 
 @pytest.mark.usefixtures("save_cache")
@@ -80,6 +960,192 @@ def test_no_google() -> None:
     assert actual == expected
 
 
+@pytest.mark.usefixtures("save_cache")
+def test_extract_all_keeps_order() -> None:
+    # no contact info, so these are skipped without calling any NER backend
+    lines = ["record {}".format(letter) for letter in "abcdefghij"]
+    entries = list(extract_info.extract_all(lines, workers=2, chunksize=3))
+    assert [entry["line"] for entry in entries] == [[line] for line in lines]
+    read: List[str] = []
+
+    def reading(lines: Iterable[str]) -> Iterator[str]:
+        for line in lines:
+            read.append(line)
+            yield line
+
+    many_lines = ["record {}".format(number) for number in range(200)]
+    first = cast(
+        Generator[extract_info.Entry, None, None],
+        extract_info.extract_all(reading(many_lines), workers=2, chunksize=1),
+    )
+    assert next(first)["line"] == ["record 0"]
+    # 4 chunks per worker are in flight, and the next is waiting to be
+    first.close()
+    assert len(read) <= 2 * 4 + 1
+
+
+def worker_cache() -> Tuple[str, str, Any, bool]:
+    "How a worker's cache is set up, run in the worker."
+    store = type(cache.store).__name__
+    return cache.cache_name, store, cache.memory.max_entries, cache.keep_key_text
+
+
+def test_worker_cache_settings(tmp_path: Any) -> None:
+    import multiprocessing
+
+    path = str(tmp_path / "custom.snapshot")
+    # workers open the overlay read only, so it has to be there already
+    cache_module.OverlayStore(path).close()
+    settings = (path, 10, None, True)
+    worker_args: Tuple[Any, ...] = (False, "fixed", {}, None, None, settings)
+    # spawned workers import extract_info afresh, unlike forked ones
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, extract_info._init_worker, worker_args) as pool:
+        assert pool.apply(worker_cache) == (path, "OverlayStore", 10, True)
+
+
+@pytest.mark.usefixtures("save_cache")
+def test_extract_incrementally(monkeypatch: Any) -> None:
+    extracted: List[str] = []
+    original_extract_info = extract_info.extract_info
+
+    def counting_extract_info(line: str) -> Any:
+        extracted.append(line)
+        return original_extract_info(line)
+
+    monkeypatch.setattr(extract_info, "extract_info", counting_extract_info)
+    func_name = extract_info.entry_func_name()
+    lines = ["incremental {}".format(letter) for letter in "abca"]
+    for line in lines + ["incremental d"]:
+        cache.delete(line, func_name)
+    entries = list(extract_info.extract_incrementally(lines, 1, 4))
+    assert [entry["line"] for entry in entries] == [[line] for line in lines]
+    # the repeated line was read before the first one had been extracted
+    assert extracted == lines
+
+    extracted.clear()
+    lines = ["incremental d", "incremental b", "incremental a", "incremental d"]
+    entries = list(extract_info.extract_incrementally(lines, 1, 2))
+    assert [entry["line"] for entry in entries] == [[line] for line in lines]
+    assert extracted == ["incremental d", "incremental d"]
+    for line in lines + ["incremental c"]:
+        cache.delete(line, func_name)
+
+    stages: Any = ([strategies.no_preprocess], [], [])
+    assert extract_info.entry_func_name(stages) != func_name
+    # and so does editing anything else an entry depends on
+    monkeypatch.setattr(
+        extract_info.space_dashes, "cache_version", "edited", raising=False
+    )
+    assert extract_info.entry_func_name() != func_name
+
+
+ENTRIES = [
+    {"line": ["a"], "emails": ["a@b.c"], "phones": [], "names": ["A", "B"]},
+    {"line": ["b"], "emails": ["b@c.d"], "phones": ["+1 555"], "names": ["B"]},
+    {"line": ["c"], "emails": [], "phones": [], "names": ["skipped"]},
+]
+
+
+def test_entry() -> None:
+    entries = [extract_info.Entry(**entry) for entry in ENTRIES]
+    assert entries == ENTRIES and ENTRIES == entries
+    assert entries[1]["phones"] == entries[1].phones == ["+1 555"]
+    assert dict(entries[0]) == ENTRIES[0]
+    assert not hasattr(entries[0], "__dict__")
+    with pytest.raises(KeyError):
+        entries[0]["FIELDS"]  # pylint: disable=pointless-statement
+    assert pickle.loads(pickle.dumps(entries)) == entries
+    saved, saved_dicts = io.StringIO(), io.StringIO()
+    extract_info.save_entries(entries, saved)
+    extract_info.save_entries(ENTRIES, saved_dicts)
+    assert saved.getvalue() == saved_dicts.getvalue()
+
+
+def test_server(tmp_path: Any) -> None:
+    def capitalized(text: str) -> List[str]:
+        return strategies.all_capitalized_extract_names(text)
+
+    stages: Any = ([capitalized], [capitalized], [strategies.remove_none])
+    line = "Bob Miller 617-555-0100"
+
+    def extract(lines: List[str]) -> List[extract_info.Entry]:
+        return [extract_info.extract_info(record, stages=stages) for record in lines]
+
+    address = str(tmp_path / "server.sock")
+    # as a server that didn't shut down cleanly leaves it
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(address)
+    with server.make_server(address, extract) as extraction_server:
+        thread = threading.Thread(target=extraction_server.serve_forever)
+        thread.start()
+        try:
+            # but one that's still listening isn't replaced
+            with pytest.raises(OSError):
+                server.make_server(address, extract)
+            response = server.call(address, {"id": 7, "record": line})
+            assert response["id"] == 7 and response["seconds"] >= 0
+            assert response["entry"] == extract([line])[0]
+            response = server.call(address, {"records": [line, "no contacts"]})
+            assert response["entries"] == extract([line, "no contacts"])
+            assert "error" in server.call(address, {"records": [1]})
+            assert "error" in server.call(address, {"lines": []})
+        finally:
+            extraction_server.shutdown()
+            thread.join()
+
+
+def test_stream_entries() -> None:
+    saved, streamed = io.StringIO(), io.StringIO()
+    extract_info.save_entries(ENTRIES, saved)
+    stream = extract_info.stream_entries(iter(ENTRIES), streamed)
+    assert next(stream) is ENTRIES[0]
+    # the first entry is written before the next one is asked for
+    assert streamed.getvalue().count("\n") == 3
+    assert list(stream) == ENTRIES[1:]
+    assert streamed.getvalue() == saved.getvalue()
+
+
+def test_count_entry_types() -> None:
+    indices_by_type, counts = extract_info.analyze_metrics(ENTRIES)
+    assert extract_info.count_entry_types(iter(ENTRIES)) == counts
+    assert counts[extract_info.EntryType.incorrect] == 1
+    for entry_type, indices in indices_by_type.items():
+        assert list(indices) == [
+            index
+            for index, entry in enumerate(ENTRIES)
+            if entry_type in extract_info.decide_entry_type(entry)
+        ]
+
+
+def test_strategy_metrics() -> None:
+    columns = extract_info.entry_type_columns(ENTRIES)
+    paths = [["google", "nltk"], ["google", "capitalized"], []]
+    breakdown = extract_info.strategy_metrics(columns, paths)
+    correct, incorrect, all_ = extract_info.EntryType
+    assert breakdown == {
+        "capitalized": {correct: 1, incorrect: 0, all_: 1},
+        "google": {correct: 1, incorrect: 1, all_: 2},
+        "nltk": {correct: 0, incorrect: 1, all_: 1},
+    }
+
+
+def test_print_strategy_metrics(tmp_path: Any, capsys: Any) -> None:
+    trace_name = str(tmp_path / "trace.jsonl")
+    with open(trace_name, "w", encoding="utf-8") as trace_file:
+        for line, path in [("b", ["google", "nltk"]), ("a", ["google", "capitalized"])]:
+            trace_file.write(json.dumps({"line": line, "path": path}) + "\n")
+    extract_info.print_strategy_metrics(ENTRIES, trace_name)
+    table = capsys.readouterr().out.splitlines()
+    assert table[0].split() == ["strategy", "correct", "incorrect", "all"]
+    assert table[2].split() == ["google", "1", "1", "2"]
+
+
+def test_read_lines() -> None:
+    in_file = io.StringIO("text,other\nfirst,x\n\"second\nline\",y\n")
+    assert list(extract_info.read_lines(in_file)) == ["first", "second\nline"]
+
+
 def test_generate_graph() -> None:
     graph = generate_graph([["", "a", "A"], ["", "b", "B"]])
     actual = {state: transition for state, transition in graph}
@@ -0,0 +1,201 @@
+"""
+Record how long each stage of each record takes, which cached calls hit, and
+which strategies found the names, to find out what's slow on real data.
+
+Tracing is off unless a trace name is given, and then extract_info's stages
+are nullcontexts, so leaving the hooks in costs next to nothing. When it's on,
+each record is written as a line of JSON as soon as it's done, and a summary
+per stage and per strategy path is printed at the end. Summarize a trace
+again later with
+
+    python -m tracing TRACE [--json]
+"""
+import sys
+import json
+import time
+import argparse
+import contextlib
+from collections import defaultdict, Counter
+from typing import Any, ContextManager, Dict, IO, Iterable, Iterator, List
+from typing import Mapping, Optional
+from cache import cache
+from tables import format_table
+
+Record = Dict[str, Any]
+NULL_CONTEXT = contextlib.nullcontext()
+
+
+class Summary:
+    "Totals for each stage and each path over traced records."
+
+    def __init__(self) -> None:
+        self.records = 0
+        self.seconds = 0.0
+        self.stages: Dict[str, Counter] = defaultdict(Counter)
+        self.paths: Dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, record: Mapping[str, Any]) -> None:
+        self.records += 1
+        self.seconds += record["seconds"]
+        for event in record["stages"]:
+            self.stages[event["stage"]].update(
+                calls=1,
+                seconds=event["seconds"],
+                hits=event["hits"],
+                misses=event["misses"],
+            )
+        path = " > ".join(record.get("path", ())) or "(none)"
+        self.paths[path].update(
+            records=1,
+            seconds=record["seconds"],
+            evaluations=record.get("evaluations", 0),
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "records": self.records,
+            "seconds": self.seconds,
+            "stages": {stage: dict(counts) for stage, counts in self.stages.items()},
+            "paths": {path: dict(counts) for path, counts in self.paths.items()},
+        }
+
+    def format(self) -> str:
+        lines = ["{} records in {:.3f}s".format(self.records, self.seconds)]
+        for title, rows, columns in [
+            ("stage", self.stages, ("calls", "seconds", "hits", "misses")),
+            ("path", self.paths, ("records", "seconds", "evaluations")),
+        ]:
+            # slowest first
+            slowest = sorted(rows.items(), key=lambda row: -row[1]["seconds"])
+            lines.append(format_table(title, dict(slowest), columns, "{:>11.4g}"))
+        return "\n".join(lines)
+
+
+def summarize(records: Iterable[Mapping[str, Any]]) -> Summary:
+    summary = Summary()
+    for record in records:
+        summary.add(record)
+    return summary
+
+
+def read_trace(trace_file: IO) -> Iterator[Record]:
+    for line in trace_file:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Tracer:
+    """
+    Stages are timed with `with tracer.stage(name):` inside of
+    `with tracer.record():`, and cached calls made in a stage count as its
+    hits and misses. In worker processes, finished records are kept until
+    pop_records, so that the parent can write them in order.
+    """
+
+    def __init__(self, trace_name: Optional[str] = None):
+        self.trace_name = trace_name
+        self.enabled = False
+        self.worker = False
+        self.trace_file: Optional[IO] = None
+        self.summary = Summary()
+        # the record being traced, and the stages in it that haven't finished
+        self.current: Optional[Record] = None
+        self.open_stages: List[Dict[str, Any]] = []
+        self.finished: List[Record] = []
+
+    def __enter__(self) -> None:
+        self.load()
+
+    def load(self, worker: bool = False) -> None:
+        trace_name = self.trace_name
+        self.enabled = trace_name is not None
+        self.worker = worker
+        self.summary = Summary()
+        self.finished = []
+        if trace_name is not None and not worker:
+            self.trace_file = open(trace_name, "w", encoding="utf-8")
+        cache.on_lookup = self.cache_lookup if self.enabled else None
+
+    def __exit__(self, *exception_info: Any) -> None:
+        cache.on_lookup = None
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+            print(self.summary.format())
+        self.enabled = False
+
+    def record(self) -> ContextManager:
+        if not self.enabled:
+            return NULL_CONTEXT
+        return self._record()
+
+    @contextlib.contextmanager
+    def _record(self) -> Iterator[None]:
+        self.current = {"seconds": 0.0, "stages": []}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record, self.current = self.current, None
+            record["seconds"] = time.perf_counter() - start
+            if self.worker:
+                self.finished.append(record)
+            else:
+                self.write(record)
+
+    def stage(self, name: str) -> ContextManager:
+        if not self.enabled:
+            return NULL_CONTEXT
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        event = {"stage": name, "seconds": 0.0, "hits": 0, "misses": 0}
+        self.open_stages.append(event)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            event["seconds"] = time.perf_counter() - start
+            self.open_stages.pop()
+            if self.current is not None:
+                self.current["stages"].append(event)
+
+    def annotate(self, **fields: Any) -> None:
+        "Add fields, e.g. the strategy path, to the record being traced."
+        if self.current is not None:
+            self.current.update(fields)
+
+    def cache_lookup(self, func_name: str, hit: bool) -> None:
+        if self.open_stages:
+            self.open_stages[-1]["hits" if hit else "misses"] += 1
+
+    def write(self, record: Record) -> None:
+        self.summary.add(record)
+        if self.trace_file:
+            self.trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.trace_file.flush()
+
+    def pop_records(self) -> List[Record]:
+        records, self.finished = self.finished, []
+        return records
+
+
+tracer = Tracer()
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Summarize a trace")
+    parser.add_argument("trace", help="JSON lines written by extract_info --trace")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args(argv)
+    with open(args.trace, encoding="utf-8") as trace_file:
+        summary = summarize(read_trace(trace_file))
+    if args.json:
+        print(json.dumps(summary.as_dict(), indent=2, ensure_ascii=False))
+    else:
+        print(summary.format())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])